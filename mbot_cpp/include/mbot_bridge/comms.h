@@ -17,6 +17,15 @@ typedef websocketpp::client<websocketpp::config::asio_client> WSClient;
 
 namespace mbot_bridge {
 
+/**
+ * Gets the current time in microseconds since the epoch.
+ */
+static inline int64_t getTimeMicro()
+{
+    auto now = std::chrono::system_clock::now();
+    return std::chrono::duration_cast<std::chrono::microseconds>(now.time_since_epoch()).count();
+}
+
 class MBotWSCommBase
 {
 public:
@@ -81,10 +90,12 @@ template <class T>
 class MBotBridgePublisher : public MBotWSCommBase
 {
 public:
-    MBotBridgePublisher(const std::string& ch, const T& data, const std::string& uri = "ws://localhost:5005") :
+    MBotBridgePublisher(const std::string& ch, const T& data, const std::string& uri = "ws://localhost:5005",
+                        const bool as_bytes = false) :
         MBotWSCommBase(uri),
         channel_(ch),
-        data_(data)
+        data_(data),
+        as_bytes_(as_bytes)
     {
         // Register the open handler.
         c_.set_open_handler(websocketpp::lib::bind(&MBotBridgePublisher::on_open, this, ::_1));
@@ -93,10 +104,29 @@ public:
 private:
     std::string channel_;
     T data_;
+    bool as_bytes_;   // Whether to publish the data as a raw LCM message.
 
     void on_open(websocketpp::connection_hdl hdl){
-        MBotJSONMessage msg(lcmTypeToString(data_), channel_, data_.getTypeName(), MBotMessageType::PUBLISH);
-        c_.send(hdl, msg.encode(), websocketpp::frame::opcode::text);
+        if (as_bytes_)
+        {
+            // Send the length of the header, the header, then the raw LCM message. The server sets the utime.
+            MBotJSONMessage header("", channel_, data_.getTypeName(), MBotMessageType::PUBLISH, true,
+                                   keyValToJSON("set_utime", "true"));
+            std::string header_str = header.encode();
+            uint32_t header_len = header_str.length();
+            int data_len = data_.getEncodedSize();
+
+            std::string payload(4 + header_len + data_len, '\0');
+            for (int i = 0; i < 4; ++i) payload[i] = (header_len >> (8 * (3 - i))) & 0xFF;
+            payload.replace(4, header_len, header_str);
+            data_.encode(&payload[4 + header_len], 0, data_len);
+            c_.send(hdl, payload, websocketpp::frame::opcode::binary);
+        }
+        else
+        {
+            MBotJSONMessage msg(lcmTypeToString(data_), channel_, data_.getTypeName(), MBotMessageType::PUBLISH);
+            c_.send(hdl, msg.encode(), websocketpp::frame::opcode::text);
+        }
 
         // Once the message is published, we don't need to wait for a message in response.
         c_.close(hdl, websocketpp::close::status::normal, "");
@@ -134,19 +164,27 @@ public:
 
     void setAsBytes(const bool as_bytes) { as_bytes_ = as_bytes; }
 
+    // Times the request was sent and the response received, in microseconds.
+    int64_t getSendTime() const { return sent_utime_; }
+    int64_t getReceiveTime() const { return recv_utime_; }
+
 private:
     std::string channel_;
     MBotMessageType res_type_;  // Response type, to check for errors.
     bool as_bytes_;             // Whether to request the data as raw bytes.
     T data_;
+    int64_t sent_utime_ = 0;
+    int64_t recv_utime_ = 0;
 
     void on_open(websocketpp::connection_hdl hdl){
         // Request the data.
         MBotJSONMessage msg("", channel_, "", MBotMessageType::REQUEST, as_bytes_);
+        sent_utime_ = getTimeMicro();
         c_.send(hdl, msg.encode(), websocketpp::frame::opcode::text);
     }
 
     void on_message(websocketpp::connection_hdl hdl, WSClient::message_ptr msg) {
+        recv_utime_ = getTimeMicro();
         if (msg->get_opcode() == websocketpp::frame::opcode::text) {
             // Data was returned as a string. Decode it as a JSON message.
             MBotJSONMessage in_msg;
@@ -183,6 +221,79 @@ private:
     }
 };
 
+
+class MBotTimeSync : public MBotWSCommBase
+{
+public:
+    MBotTimeSync(const std::string& uri = "ws://localhost:5005", const int samples = 5) :
+        MBotWSCommBase(uri),
+        samples_(samples),
+        count_(0),
+        offset_(0),
+        rtt_(-1)
+    {
+        // Register the open handler.
+        c_.set_open_handler(websocketpp::lib::bind(&MBotTimeSync::on_open, this, ::_1));
+        c_.set_message_handler(websocketpp::lib::bind(&MBotTimeSync::on_message, this, ::_1, ::_2));
+    };
+
+    bool success() const { return rtt_ >= 0 && !failed_; }
+
+    // Offset from this computer's clock to the server's, in microseconds.
+    int64_t getOffset() const { return offset_; }
+    // Shortest round trip time to the server, in microseconds.
+    int64_t getRoundTripTime() const { return rtt_; }
+
+private:
+    int samples_;
+    int count_;
+    int64_t offset_;
+    int64_t rtt_;
+    int64_t sent_utime_ = 0;
+
+    void request(websocketpp::connection_hdl hdl)
+    {
+        MBotJSONMessage msg("", "TIME", "", MBotMessageType::REQUEST);
+        sent_utime_ = getTimeMicro();
+        c_.send(hdl, msg.encode(), websocketpp::frame::opcode::text);
+    }
+
+    void on_open(websocketpp::connection_hdl hdl){
+        request(hdl);
+    }
+
+    void on_message(websocketpp::connection_hdl hdl, WSClient::message_ptr msg) {
+        int64_t recv_utime = getTimeMicro();
+
+        MBotJSONMessage in_msg;
+        in_msg.decode(msg->get_payload());
+        std::string utime = fetchVal(in_msg.data(), "utime");
+        if (in_msg.type() != MBotMessageType::RESPONSE || utime.length() == 0)
+        {
+            std::cout << "[MBot API] WARNING: Time synchronization failed." << std::endl;
+            failed_ = true;
+            c_.close(hdl, websocketpp::close::status::normal, "");
+            return;
+        }
+
+        // Keep the sample with the shortest round trip, assuming the server read its clock halfway through it.
+        int64_t rtt = recv_utime - sent_utime_;
+        if (rtt_ < 0 || rtt < rtt_)
+        {
+            rtt_ = rtt;
+            offset_ = std::stoll(utime) - (sent_utime_ + recv_utime) / 2;
+        }
+
+        if (++count_ < samples_)
+        {
+            request(hdl);
+            return;
+        }
+
+        c_.close(hdl, websocketpp::close::status::normal, "");
+    }
+};
+
 }   // namespace mbot_bridge
 
 #endif // MBOT_BRIDGE_WEBSOCKET_H
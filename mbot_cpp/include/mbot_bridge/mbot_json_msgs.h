@@ -31,17 +31,19 @@ public:
         channel_(""),
         dtype_(""),
         rtype_(MBotMessageType::INVALID),
-        as_bytes_(false)
+        as_bytes_(false),
+        params_("")
     {};
 
     MBotJSONMessage(const std::string& data, const std::string& ch,
                     const std::string& dtype, const MBotMessageType& rtype,
-                    const bool as_bytes = false) :
+                    const bool as_bytes = false, const std::string& params = "") :
         data_(data),
         channel_(ch),
         dtype_(dtype),
         rtype_(rtype),
-        as_bytes_(as_bytes)
+        as_bytes_(as_bytes),
+        params_(params)
     {};
 
     std::string encode() const
@@ -63,11 +65,16 @@ public:
         {
             oss << "," << "\"data\":{" << data_ << "}";
         }
-        if (rtype_ == MBotMessageType::REQUEST)
+        if (rtype_ == MBotMessageType::REQUEST || as_bytes_)
         {
             // If we are requesting data, include whether or not it should be in byte form.
+            // Raw publishes also set this, since their data comes after the message.
             oss << "," << keyValToJSON("as_bytes", as_bytes_);
         }
+        if (params_.length() > 0)
+        {
+            oss << "," << "\"params\":{" << params_ << "}";
+        }
         oss << "}";  // Close msg.
 
         return oss.str();
@@ -120,6 +127,7 @@ private:
     std::string dtype_;
     MBotMessageType rtype_;
     bool as_bytes_;
+    std::string params_;
 
     std::string typeToString(const MBotMessageType& t) const
     {
@@ -14,23 +14,27 @@
 
 namespace mbot_bridge {
 
-/**
- * Gets the current time in microseconds.
- */
-static inline int getTimeMicro()
-{
-    auto now = std::chrono::system_clock::now();
-    return now.time_since_epoch().count();
-}
-
 class MBot
 {
 public:
-    MBot(const std::string& hostname = "localhost", const int port = 5005)
+    MBot(const std::string& hostname = "localhost", const int port = 5005) :
+        clock_offset_(0),
+        rtt_(0),
+        synced_(false),
+        last_age_(-1),
+        last_transport_(-1)
     {
         uri_ = "ws://" + hostname + ":" + std::to_string(port);
     }
 
+    // Clock synchronization.
+    bool syncTime(const int samples = 5);
+    double getClockOffset() const { return clock_offset_ / 1e6; }
+    double getRoundTripTime() const { return rtt_ / 1e6; }
+    // Latency of the latest read, in seconds. The age is -1 until the time is synchronized.
+    double getLastAge() const { return last_age_; }
+    double getLastTransportLatency() const { return last_transport_; }
+
     // Pubs.
     void drive(const float vx, const float vy, const float wz) const;
     void stop() const;
@@ -44,6 +48,18 @@ public:
 
 private:
     std::string uri_;
+    int64_t clock_offset_;  // Offset from this computer's clock to the server's, in microseconds.
+    int64_t rtt_;           // Round trip time to the server, in microseconds.
+    bool synced_;
+    mutable double last_age_;
+    mutable double last_transport_;
+
+    template <class T>
+    void recordLatency(const MBotBridgeReader<T>& reader, const int64_t utime) const
+    {
+        last_transport_ = (reader.getReceiveTime() - reader.getSendTime()) / 2e6;
+        last_age_ = synced_ ? (reader.getReceiveTime() + clock_offset_ - utime) / 1e6 : -1;
+    }
 
 };
 
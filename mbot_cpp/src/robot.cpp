@@ -58,10 +58,24 @@ void MBot::drivePath(const std::vector<std::array<float, 3> >& path) const
 
     msg.path_length = path.size();
 
-    MBotBridgePublisher<mbot_lcm_msgs::path2D_t> pub(CONTROLLER_PATH_CHANNEL, msg, uri_);
+    // Paths can be long, so publish the raw LCM message.
+    MBotBridgePublisher<mbot_lcm_msgs::path2D_t> pub(CONTROLLER_PATH_CHANNEL, msg, uri_, true);
     pub.run();
 }
 
+bool MBot::syncTime(const int samples)
+{
+    MBotTimeSync sync(uri_, samples);
+    sync.run();
+
+    if (!sync.success()) return false;
+
+    clock_offset_ = sync.getOffset();
+    rtt_ = sync.getRoundTripTime();
+    synced_ = true;
+    return true;
+}
+
 void MBot::readLidarScan(std::vector<float>& ranges, std::vector<float>& thetas) const
 {
     // Empty the vectors.
@@ -75,6 +89,7 @@ void MBot::readLidarScan(std::vector<float>& ranges, std::vector<float>& thetas)
     if (reader.success())
     {
         mbot_lcm_msgs::lidar_t data = reader.getData();
+        recordLatency(reader, data.utime);
         ranges = data.ranges;
         thetas = data.thetas;
     }
@@ -90,6 +105,7 @@ std::vector<float> MBot::readOdometry() const
     if (reader.success())
     {
         mbot_lcm_msgs::pose2D_t data = reader.getData();
+        recordLatency(reader, data.utime);
         odom = {data.x, data.y, data.theta};
     }
 
@@ -106,6 +122,7 @@ std::vector<float> MBot::readSlamPose() const
     if (reader.success())
     {
         mbot_lcm_msgs::pose2D_t data = reader.getData();
+        recordLatency(reader, data.utime);
         pose = {data.x, data.y, data.theta};
     }
 
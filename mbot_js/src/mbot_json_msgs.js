@@ -12,11 +12,12 @@ const MBotMessageType = {
 
 
 class MBotJSONMessage {
-  constructor(data=null, ch=null, dtype=null, rtype=null) {
+  constructor(data=null, ch=null, dtype=null, rtype=null, params=null) {
     this.data = data;
     this.channel = ch;
     this.dtype = dtype;
     this.rtype = rtype;
+    this.params = params;
   }
 
   encode() {
@@ -42,6 +43,7 @@ class MBotJSONMessage {
     if (this.channel !== null) msg.channel = this.channel;
     if (this.dtype !== null) msg.dtype = this.dtype;
     if (this.data !== null) msg.data = this.data;
+    if (this.params !== null) msg.params = this.params;
 
     return JSON.stringify(msg);
   }
@@ -77,9 +79,11 @@ class MBotJSONMessage {
     let channel = null;
     let msg_data = null;
     let dtype = null;
+    let params = null;
     if (data.channel !== undefined) channel = data.channel;
     if (data.data !== undefined) msg_data = data.data;
     if (data.dtype !== undefined) dtype = data.dtype;
+    if (data.params !== undefined) params = data.params;
 
     // TODO: Raise errors for bad data combinations.
 
@@ -87,6 +91,7 @@ class MBotJSONMessage {
     this.data = msg_data;
     this.dtype = dtype;
     this.rtype = request_type;
+    this.params = params;
   }
 }
 
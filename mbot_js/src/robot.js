@@ -16,22 +16,60 @@ class MBot {
   constructor(hostname = "localhost", port = 5005) {
     this.address = "ws://" + hostname + ":" + port;
     this.ws_subs = {};
+
+    // The offset from this computer's clock to the server's and the round trip time to the server, in microseconds.
+    // Set by syncTime().
+    this.clockOffset = null;
+    this.rtt = null;
+    // The latency of the latest message received on each channel.
+    this.latency = {};
+  }
+
+  /**
+   * Private method to get the current time, in microseconds since the epoch.
+   *
+   * @returns {number} - The current time.
+   * @private
+   */
+  _now() {
+    return Math.round((performance.timeOrigin + performance.now()) * 1000);
+  }
+
+  /**
+   * Private method to attach the latency of a message to it, as res.latency, and store it in this.latency.
+   *
+   * @param {string} ch - The channel the message was received on.
+   * @param {MBotJSONMessage} res - The message.
+   * @param {number} transport - The time the message took to reach this computer, in seconds, or null if unknown.
+   * @private
+   */
+  _recordLatency(ch, res, transport) {
+    // The age of the message can only be known once the offset to the server's clock is known.
+    let age = null;
+    if (this.clockOffset !== null && res.data !== null && typeof res.data.utime === "number") {
+      age = (this._now() + this.clockOffset - res.data.utime) / 1e6;
+    }
+    res.latency = { age: age, transport: transport };
+    this.latency[ch] = res.latency;
   }
 
   /**
    * Private method to send a data request to a specified channel and receive the response.
    *
    * @param {string} ch - The channel to read data from.
+   * @param {Object} [params=null] - Extra parameters for the request.
    * @returns {Promise} - A Promise that resolves with the received data or rejects if there is an error.
    * @private
    */
-  _read(ch) {
-    let msg = new MBotJSONMessage(null, ch, null, MBotMessageType.REQUEST);
+  _read(ch, params = null) {
+    let msg = new MBotJSONMessage(null, ch, null, MBotMessageType.REQUEST, params);
 
     let promise = new Promise((resolve, reject) => {
       const websocket = new WebSocket(this.address);
+      let sent = null;
 
       websocket.onopen = (event) => {
+        sent = this._now();
         websocket.send(msg.encode());
       };
 
@@ -39,6 +77,7 @@ class MBot {
         let res = new MBotJSONMessage();
         res.decode(event.data);
         websocket.close(1000);  // 1000 indicates a normal close.
+        this._recordLatency(ch, res, (this._now() - sent) / 2e6);
 
         // Check for error from the server.
         if (res.rtype === MBotMessageType.ERROR) {
@@ -85,12 +124,15 @@ class MBot {
    *
    * @param {string} ch - The channel to subscribe to.
    * @param {function} cb - The callback function to handle incoming messages from the specified channel.
+   * @param {Object} [params=null] - Extra parameters for the subscription. For example, {lidar_bins: 180} to receive
+   *                                 lidar scans binned to 180 rays, or {map_level: 2} to receive maps at 4x lower
+   *                                 resolution.
    * @returns {Promise} - A Promise that resolves when the connection to the MBot Bridge is successfully opened and the
    *                      subscription message is sent. It rejects if there is an error in establishing the connection
    *                      or sending the subscription message.
    */
-  subscribe(ch, cb) {
-    let msg = new MBotJSONMessage(null, ch, null, MBotMessageType.SUBSCRIBE);
+  subscribe(ch, cb, params = null) {
+    let msg = new MBotJSONMessage(null, ch, null, MBotMessageType.SUBSCRIBE, params);
     if (this.ws_subs[ch]) {
       return Promise.resolve();
     }
@@ -111,6 +153,13 @@ class MBot {
           reject("MBot API Error: " + res.data + " on channel: " + ch);
         }
         else {
+          // The server sends the time it received the data, so the transport latency is known once the clocks are
+          // synchronized.
+          let transport = null;
+          if (this.clockOffset !== null && res.params !== null && res.params.recv_utime !== undefined) {
+            transport = (this._now() + this.clockOffset - res.params.recv_utime) / 1e6;
+          }
+          this._recordLatency(ch, res, transport);
           cb(res);
           resolve();  // Resolve on first successful callback.
         }
@@ -160,6 +209,70 @@ class MBot {
     });
   }
 
+  /**
+   * Estimates the offset from this computer's clock to the server's, and the round trip time to the server. The
+   * sample with the shortest round trip is used, since it is the least affected by delays. Once the offset is known,
+   * the age of received messages is computed, and stored in res.latency and this.latency.
+   *
+   * @param {number} [samples=5] - The number of time requests to send.
+   * @returns {Promise<Object>} - A Promise that resolves with the clock offset and round trip time, in seconds, as
+   *                              {offset, rtt}. The offset is positive if the server's clock is ahead.
+   */
+  syncTime(samples = 5) {
+    let msg = new MBotJSONMessage(null, "TIME", null, MBotMessageType.REQUEST);
+
+    let promise = new Promise((resolve, reject) => {
+      const websocket = new WebSocket(this.address);
+      let best = null;
+      let count = 0;
+      let sent = null;
+
+      const sendRequest = () => {
+        sent = this._now();
+        websocket.send(msg.encode());
+      };
+
+      websocket.onopen = (event) => {
+        sendRequest();
+      };
+
+      websocket.onmessage = (event) => {
+        let received = this._now();
+        let res = new MBotJSONMessage();
+        res.decode(event.data);
+
+        if (res.rtype !== MBotMessageType.RESPONSE) {
+          websocket.close(1000);
+          reject("MBot API Error: Can't synchronize time with the MBot Bridge Server.");
+          return;
+        }
+
+        // Assume the server read its clock halfway through the round trip.
+        let rtt = received - sent;
+        if (best === null || rtt < best.rtt) {
+          best = { offset: res.data.utime - (sent + received) / 2, rtt: rtt };
+        }
+
+        count++;
+        if (count < samples) {
+          sendRequest();
+          return;
+        }
+
+        websocket.close(1000);  // 1000 indicates a normal close.
+        this.clockOffset = best.offset;
+        this.rtt = best.rtt;
+        resolve({ offset: best.offset / 1e6, rtt: best.rtt / 1e6 });
+      };
+
+      websocket.onerror = (event) => {
+        reject("MBot API Error: MBot Bridge Server connection error.");
+      };
+    });
+
+    return promise;
+  }
+
   /*******************
    * READING HELPERS *
    *******************/
@@ -168,11 +281,12 @@ class MBot {
    * Reads the latest data from a specified channel.
    *
    * @param {string} ch - The channel to read data from.
+   * @param {Object} [params=null] - Extra parameters for the request.
    * @returns {Promise<*>} - A Promise that resolves with the latest data from the specified channel.
    */
-  readData(ch) {
+  readData(ch, params = null) {
     let promise = new Promise((resolve, reject) => {
-      this._read(ch).then((val) => {
+      this._read(ch, params).then((val) => {
         resolve(val.data);
       }).catch((error) => {
         reject(error);
@@ -218,9 +332,16 @@ class MBot {
     return promise;
   }
 
-  readMap() {
+  /**
+   * Reads the latest SLAM map.
+   *
+   * @param {number} [level=0] - The map resolution level. Level k is downsampled 2^k times by the server, up to 3.
+   * @returns {Promise<Object>} - A Promise that resolves with the map data, with the cells as an Int8Array.
+   */
+  readMap(level = 0) {
+    const params = level > 0 ? {map_level: level} : null;
     let promise = new Promise((resolve, reject) => {
-      this._read(config.SLAM_MAP.channel).then((msg) => {
+      this._read(config.SLAM_MAP.channel, params).then((msg) => {
         const data = msg.data;
         // Read the cells as a byte array.
         let binaryString = atob(data.cells);
@@ -1 +1,2 @@
 from .mbot import MBot
+from .fleet import MBotFleet
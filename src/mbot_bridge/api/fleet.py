@@ -0,0 +1,330 @@
+import queue
+import threading
+from mbot_bridge.utils import type_utils
+from mbot_bridge.utils.lazy import LazyModule
+from mbot_bridge.utils.json_messages import (
+    MBotJSONRequest, MBotJSONPublish, MBotRawPublish, MBotJSONMessage, MBotMessageType
+)
+from .mbot import MBot
+from .lcm_config import LCMConfig
+
+# These are only imported once a fleet is created, so that scripts start quickly.
+asyncio = LazyModule("asyncio")
+websockets = LazyModule("websockets")
+
+
+class _Bridge(object):
+    """Connections to one MBot Bridge server in the fleet."""
+
+    def __init__(self, host, port, connect_timeout=5, pool_size=2):
+        self.host = host
+        self.port = port
+        self.mbot = MBot(host, port, connect_timeout=connect_timeout)
+        self.uri = self.mbot.uri
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+
+        # The name the bridge's data is tagged with. Set from the hostname when the fleet connects.
+        self.tag = f"{host}:{port}"
+
+        self._idle = []       # Open connections which are not in use.
+        self._num_open = 0
+        self._available = None
+        self._sub_ws = None   # The connection used for subscriptions.
+        self._sub_task = None
+        self._pub_ws = None   # The connection used for publishes.
+        self._pub_task = None
+        self._pub_lock = None
+
+    async def _acquire(self):
+        if self._available is None:
+            self._available = asyncio.Condition()
+
+        async with self._available:
+            while len(self._idle) == 0 and self._num_open >= self.pool_size:
+                await self._available.wait()
+            if len(self._idle) > 0:
+                return self._idle.pop()
+            self._num_open += 1
+
+        try:
+            return await websockets.connect(self.uri, open_timeout=self.connect_timeout)
+        except BaseException:
+            await self._release(None)
+            raise
+
+    async def _release(self, ws):
+        async with self._available:
+            if ws is not None and ws.open:
+                self._idle.append(ws)
+            else:
+                # The connection was closed, so another one can be opened.
+                self._num_open -= 1
+            self._available.notify()
+
+    async def send(self, msg):
+        """Sends a request on a pooled connection, and waits for the response. Returns None if the bridge can't be
+        reached."""
+        try:
+            ws = await self._acquire()
+        except (OSError, asyncio.exceptions.TimeoutError, websockets.exceptions.WebSocketException):
+            print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
+            return
+
+        response = None
+        try:
+            await ws.send(msg)
+            response = await ws.recv()
+        except websockets.exceptions.ConnectionClosed:
+            print(f"[MBot API] ERROR: Lost connection to MBot Bridge at: {self.uri}")
+            await ws.close()
+        await self._release(ws)
+        return response
+
+    async def publish(self, msg):
+        """Sends a publish on its own connection. The server only replies if the publish fails, so the replies can't
+        be matched to requests on a pooled connection."""
+        if self._pub_lock is None:
+            self._pub_lock = asyncio.Lock()
+
+        async with self._pub_lock:
+            if self._pub_ws is None or not self._pub_ws.open:
+                try:
+                    self._pub_ws = await websockets.connect(self.uri, open_timeout=self.connect_timeout)
+                except (OSError, asyncio.exceptions.TimeoutError, websockets.exceptions.WebSocketException):
+                    print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
+                    self._pub_ws = None
+                    return
+                self._pub_task = asyncio.ensure_future(self._publish_errors(self._pub_ws))
+
+        try:
+            await self._pub_ws.send(msg)
+        except websockets.exceptions.ConnectionClosed:
+            print(f"[MBot API] ERROR: Lost connection to MBot Bridge at: {self.uri}")
+
+    async def _publish_errors(self, ws):
+        try:
+            async for message in ws:
+                msg = MBotJSONMessage(message, from_json=True)
+                print(f"[MBot API] ERROR: {self.tag}:", msg.data())
+        except websockets.exceptions.ConnectionClosedError:
+            pass
+
+    async def subscribe(self, channel, params, out):
+        if self._sub_ws is None:
+            try:
+                self._sub_ws = await websockets.connect(self.uri, open_timeout=self.connect_timeout)
+            except (OSError, asyncio.exceptions.TimeoutError, websockets.exceptions.WebSocketException):
+                print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
+                return
+            self._sub_task = asyncio.ensure_future(self._receive(out))
+
+        msg = MBotJSONMessage(channel=channel, rtype=MBotMessageType.SUBSCRIBE, params=params)
+        await self._sub_ws.send(msg.encode())
+
+    async def unsubscribe(self, channel):
+        if self._sub_ws is not None:
+            await self._sub_ws.send(MBotJSONMessage(channel=channel, rtype=MBotMessageType.UNSUBSCRIBE).encode())
+
+    async def _receive(self, out):
+        try:
+            async for message in self._sub_ws:
+                msg = MBotJSONMessage(message, from_json=True)
+                if msg.type() == MBotMessageType.ERROR:
+                    print(f"[MBot API] ERROR: {self.tag}:", msg.data())
+                    continue
+                try:
+                    data = type_utils.dict_to_lcm_type(msg.data(), msg.dtype())
+                except type_utils.BadMessageError as e:
+                    print(f"[MBot API] ERROR: {self.tag}:", e)
+                    continue
+                out.put((self.tag, msg.channel(), data))
+        except websockets.exceptions.ConnectionClosedError:
+            print(f"[MBot API] ERROR: Lost subscriptions to MBot Bridge at: {self.uri}")
+
+    async def close(self):
+        if self._pub_ws is not None:
+            await self._pub_ws.close()
+            await self._pub_task
+            self._pub_ws = None
+        if self._sub_ws is not None:
+            await self._sub_ws.close()
+            await self._sub_task
+            self._sub_ws = None
+        for ws in self._idle:
+            await ws.close()
+        self._idle = []
+        self._num_open = 0
+
+
+class MBotFleet(object):
+    """Utility class for controlling a fleet of mbots, each running its own MBot Bridge server.
+
+    Connections to each bridge are kept open and reused between calls. Reads
+    and publishes are sent to all the robots at the same time, and the results
+    are returned in a dictionary keyed by each robot's hostname.
+    """
+
+    def __init__(self, bridges, connect_timeout=5, pool_size=2):
+        """
+        Args:
+            bridges (list): The bridges to connect to. Each is a host name, a "host:port" string or a (host, port)
+                            tuple. The default port is 5005.
+            connect_timeout (float, optional): The timeout to connect to each bridge, in seconds. Defaults to 5.
+            pool_size (int, optional): The most connections to keep open to each bridge. Defaults to 2.
+        """
+        self._bridges = []
+        for bridge in bridges:
+            if isinstance(bridge, str):
+                host, _, port = bridge.partition(":")
+                bridge = (host, int(port) if port else 5005)
+            self._bridges.append(_Bridge(bridge[0], bridge[1], connect_timeout=connect_timeout, pool_size=pool_size))
+
+        self.lcm_config = LCMConfig()
+
+        # All the connections run on one event loop in a background thread.
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+        # Subscribed data from all the bridges.
+        self._messages = queue.Queue()
+
+        self._tag_bridges()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _run_all(self, func, bridges=None):
+        # Runs a coroutine for each bridge concurrently, and returns the results keyed by the bridge's tag.
+        bridges = self._bridges if bridges is None else bridges
+
+        async def run():
+            return await asyncio.gather(*[func(bridge) for bridge in bridges])
+
+        return dict(zip([bridge.tag for bridge in bridges], self._run(run())))
+
+    def _tag_bridges(self):
+        # Tag each bridge with its hostname. If several bridges have the same hostname, for example several servers
+        # running on the same computer, the port is added to tell them apart.
+        hostnames = self._run_all(lambda b: self._request(b, "HOSTNAME"))
+        seen = set()
+        for bridge in self._bridges:
+            hostname = hostnames[bridge.tag]
+            if not hostname:
+                # The bridge couldn't be reached or has no hostname, so keep its address.
+                continue
+            bridge.tag = hostname if hostname not in seen else f"{hostname}:{bridge.port}"
+            seen.add(hostname)
+
+    def hostnames(self):
+        """The hostnames of the robots in the fleet. Robots which could not be reached are named by their address."""
+        return [bridge.tag for bridge in self._bridges]
+
+    def _select(self, hostnames):
+        if hostnames is None:
+            return self._bridges
+        return [bridge for bridge in self._bridges if bridge.tag in hostnames]
+
+    async def _request(self, bridge, ch, dtype=None, as_bytes=False, request_as_bytes=False, params=None):
+        req = MBotJSONRequest(ch, dtype=dtype, as_bytes=request_as_bytes, params=params)
+        response = await bridge.send(req.encode())
+        if response is None:
+            return
+        return bridge.mbot._process_response(response, ch, dtype, as_bytes)
+
+    """PUBLISHERS"""
+
+    def publish(self, channel, data, dtype, hostnames=None):
+        """Publishes data to every robot in the fleet, or only the given robots.
+
+        Args:
+            channel (str): The name of the channel to publish to.
+            data (dict): The data to publish.
+            dtype (str): The data type of the message.
+            hostnames (list, optional): The robots to publish to. Defaults to None, all the robots.
+        """
+        msg = MBotJSONPublish(data, channel, dtype).encode()
+        self._run_all(lambda b: b.publish(msg), self._select(hostnames))
+
+    def publish_bytes(self, channel, data, dtype, set_utime=False, hostnames=None):
+        """Publishes a raw LCM message to every robot in the fleet, or only the given robots. See
+        MBot.publish_bytes()."""
+        msg = MBotRawPublish(data, channel, dtype, set_utime=set_utime).encode()
+        self._run_all(lambda b: b.publish(msg), self._select(hostnames))
+
+    def drive(self, vx, vy, wz, hostnames=None):
+        data = {"vx": vx, "vy": vy, "wz": wz}
+        self.publish(self.lcm_config.MOTOR_VEL_CMD.channel, data, self.lcm_config.MOTOR_VEL_CMD.dtype,
+                     hostnames=hostnames)
+
+    def stop(self, hostnames=None):
+        self.drive(0, 0, 0, hostnames=hostnames)
+
+    """SUBSCRIBERS"""
+
+    def read_data(self, channel, dtype=None, as_bytes=False, params=None, hostnames=None):
+        """Reads the latest data on a channel from every robot in the fleet, or only the given robots.
+
+        Args:
+            channel (str): The name of the channel to read the data from.
+            dtype (str, optional): The data type of the data on the channel. Required if as_bytes is False.
+                                   Defaults to None.
+            as_bytes (bool, optional): Whether to return the data as raw bytes. Defaults to False.
+            params (dict, optional): Extra parameters for the request. Defaults to None.
+            hostnames (list, optional): The robots to read from. Defaults to None, all the robots.
+
+        Returns:
+            dict: The data from each robot, keyed by hostname. The data is None for robots where the read failed.
+        """
+        return self._run_all(lambda b: self._request(b, channel, dtype, as_bytes=as_bytes,
+                                                     request_as_bytes=as_bytes, params=params),
+                             self._select(hostnames))
+
+    def _read_pose(self, channel, hostnames=None):
+        res = self._run_all(lambda b: self._request(b, channel.channel, channel.dtype, request_as_bytes=True),
+                            self._select(hostnames))
+        return {k: [v.x, v.y, v.theta] if v is not None else [] for k, v in res.items()}
+
+    def read_odometry(self, hostnames=None):
+        """Reads the odometry of each robot. Returns a dictionary of [x, y, theta], keyed by hostname."""
+        return self._read_pose(self.lcm_config.ODOMETRY, hostnames)
+
+    def read_slam_pose(self, hostnames=None):
+        """Reads the SLAM pose of each robot. Returns a dictionary of [x, y, theta], keyed by hostname."""
+        return self._read_pose(self.lcm_config.SLAM_POSE, hostnames)
+
+    def subscribe(self, channel, params=None, hostnames=None):
+        """Subscribes to a channel on every robot in the fleet, or only the given robots. The data from all the
+        robots is returned by listen().
+
+        Args:
+            channel (str): The name of the channel to subscribe to.
+            params (dict, optional): Extra parameters for the subscription, for example to reduce the resolution of
+                                     the data. Defaults to None.
+            hostnames (list, optional): The robots to subscribe to. Defaults to None, all the robots.
+        """
+        self._run_all(lambda b: b.subscribe(channel, params, self._messages), self._select(hostnames))
+
+    def unsubscribe(self, channel, hostnames=None):
+        self._run_all(lambda b: b.unsubscribe(channel), self._select(hostnames))
+
+    def listen(self, timeout=None):
+        """Yields the subscribed data from all the robots as it arrives, as (hostname, channel, msg) tuples, where msg
+        is an LCM message type.
+
+        Args:
+            timeout (float, optional): Stop if there is no new data for this many seconds. Defaults to None, which
+                                       waits forever.
+        """
+        while True:
+            try:
+                yield self._messages.get(timeout=timeout)
+            except queue.Empty:
+                return
+
+    def close(self):
+        """Closes all the connections to the fleet."""
+        self._run_all(lambda b: b.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
@@ -1,19 +1,42 @@
-import websockets
-import asyncio
+import struct
+import time
+import base64
 from mbot_bridge.utils import type_utils
+from mbot_bridge.utils.lazy import LazyModule
 from mbot_bridge.utils.json_messages import (
-    MBotJSONRequest, MBotJSONPublish, MBotJSONMessage, MBotMessageType
+    MBotJSONRequest, MBotJSONPublish, MBotRawPublish, MBotJSONRange, MBotJSONMessage, MBotMessageType
 )
-from .lcm_config import LCMConfig
+from .lcm_config import LCMConfig, MBotChannel
+
+# These are only imported once the first message is sent, so that scripts start quickly.
+asyncio = LazyModule("asyncio")
+websockets = LazyModule("websockets")
 
 
 class MBot(object):
     """Utility class for controlling the mbot."""
 
-    def __init__(self, host="localhost", port=5005, connect_timeout=5):
+    # Returned by _request() when the server reports the data hasn't changed since the given utime.
+    UNCHANGED = object()
+
+    def __init__(self, host="localhost", port=5005, connect_timeout=5, tracer=None):
         self.uri = f"ws://{host}:{port}"
         self.connect_timeout = connect_timeout
         self.lcm_config = LCMConfig()
+        # Optional mbot_bridge.utils.tracing.Tracer to record the time spent in each stage of a read.
+        self.tracer = tracer
+
+        # The utime of the latest message read on each channel with read_next().
+        self._last_utimes = {}
+        # The latest map read with read_map() at each level, as (utime, cells, info).
+        self._map_cache = {}
+
+        # The offset from this computer's clock to the server's, and the round trip time to the server, in
+        # microseconds. Set by sync_time().
+        self._clock_offset = None
+        self._rtt = None
+        # The age and transport latency of the latest message read on each channel.
+        self._latencies = {}
 
     """PUBLISHERS"""
 
@@ -26,6 +49,28 @@ class MBot(object):
             print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
             return
 
+    async def _send_bytes(self, ch, data, dtype, set_utime=False):
+        res = MBotRawPublish(data, ch, dtype, set_utime=set_utime)
+        try:
+            async with websockets.connect(self.uri, open_timeout=self.connect_timeout) as websocket:
+                await websocket.send(res.encode())
+        except asyncio.exceptions.TimeoutError:
+            print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
+            return
+
+    def publish_bytes(self, channel, data, dtype, set_utime=False):
+        """Publishes a raw LCM message. The server checks the message has the type's fingerprint and publishes it
+        without decoding it, which is much faster than publishing JSON data for large messages.
+
+        Args:
+            channel (str): The name of the channel to publish to.
+            data (bytes): The encoded LCM message.
+            dtype (str): The data type of the message.
+            set_utime (bool, optional): Whether the server should set the utime of the message to the time it is
+                                        published. The type must start with a utime field. Defaults to False.
+        """
+        asyncio.run(self._send_bytes(channel, data, dtype, set_utime=set_utime))
+
     def drive(self, vx, vy, wz):
         data = {"vx": vx, "vy": vy, "wz": wz}
         asyncio.run(self._send(self.lcm_config.MOTOR_VEL_CMD.channel, data, self.lcm_config.MOTOR_VEL_CMD.dtype))
@@ -40,11 +85,14 @@ class MBot(object):
     def drive_path(self, path):
         path_data = [{"x": p[0], "y": p[1], "theta": p[2] if len(p) == 3 else 0} for p in path]
         data = {"path_length": len(path), "path": path_data}
-        asyncio.run(self._send(self.lcm_config.CONTROLLER_PATH.channel, data, self.lcm_config.CONTROLLER_PATH.dtype))
+        # Paths can be long, so encode the message here and publish the raw data.
+        msg = type_utils.dict_to_lcm_type(data, self.lcm_config.CONTROLLER_PATH.dtype)
+        self.publish_bytes(self.lcm_config.CONTROLLER_PATH.channel, msg.encode(), self.lcm_config.CONTROLLER_PATH.dtype,
+                           set_utime=True)
 
     """SUBSCRIBERS"""
 
-    async def _request(self, ch, dtype=None, as_bytes=False, request_as_bytes=False):
+    async def _request(self, ch, dtype=None, as_bytes=False, request_as_bytes=False, params=None):
         """Internal wrapper to request data from the MBot Bridge Server.
 
         Args:
@@ -53,23 +101,66 @@ class MBot(object):
                                    Defaults to None.
             as_bytes (bool, optional): Whether to return the data as bytes. Defaults to False.
             request_as_bytes (bool, optional): Whether to request the data to be sent as bytes. Defaults to True.
+            params (dict, optional): Extra parameters for the request. Defaults to None.
 
         Returns:
             (bytes or obj): The data returned by the server. If as_bytes is False, the data is returned as an
                             LCM message type. If True, the data is returned in raw bytes. Returns None if fetching the
                             data fails.
         """
-        res = MBotJSONRequest(ch, dtype=dtype, as_bytes=request_as_bytes)
+        trace = self.tracer.start(ch, "read") if self.tracer is not None else None
+        res = MBotJSONRequest(ch, dtype=dtype, as_bytes=request_as_bytes, params=params)
         try:
             async with websockets.connect(self.uri, open_timeout=self.connect_timeout) as websocket:
+                if trace is not None:
+                    trace.mark("connect")
+                sent_utime = time.time_ns() // 1000
                 await websocket.send(res.encode())
 
                 # Wait for the response
                 response = await websocket.recv()
+                recv_utime = time.time_ns() // 1000
+                if trace is not None:
+                    trace.mark("receive")
         except asyncio.exceptions.TimeoutError:
             print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
             return
 
+        res_params = {}
+        msg = self._process_response(response, ch, dtype, as_bytes, res_params=res_params)
+        if trace is not None:
+            trace.mark("decode")
+            trace.finish()
+        if msg is not None and msg is not self.UNCHANGED:
+            waited = params is not None and params.get("wait", False)
+            self._record_latency(ch, msg, dtype, sent_utime, recv_utime, res_params.get("recv_utime"), waited)
+        return msg
+
+    def _record_latency(self, ch, msg, dtype, sent_utime, recv_utime, server_recv_utime=None, waited=False):
+        if isinstance(msg, bytes):
+            # Only read the utime of raw data if it doesn't need the whole message to be decoded.
+            utime = None
+            if dtype is not None and len(msg) >= 16 and type_utils.has_leading_utime(dtype):
+                utime = type_utils.read_utime(msg, dtype)
+        else:
+            utime = getattr(msg, "utime", None)
+
+        # The message age can only be known once the offset to the server's clock is known.
+        age = None
+        if utime is not None and self._clock_offset is not None:
+            age = (recv_utime + self._clock_offset - utime) / 1e6
+
+        transport = (recv_utime - sent_utime) / 2e6
+        if waited:
+            # The round trip includes the time the server waited for the data. If it waited, it replied as soon as it
+            # received the data, so the transport latency is at most the time since then.
+            if server_recv_utime is not None and self._clock_offset is not None:
+                transport = min(transport, (recv_utime + self._clock_offset - server_recv_utime) / 1e6)
+            else:
+                transport = None
+        self._latencies[ch] = {"age": age, "transport": transport}
+
+    def _process_response(self, response, ch, dtype=None, as_bytes=False, res_params=None):
         # If the data was requested as bytes and returned as bytes, return the raw data.
         if isinstance(response, bytes) and as_bytes:
             return response
@@ -89,6 +180,8 @@ class MBot(object):
 
         # If this was not bytes, process the JSON message.
         response = MBotJSONMessage(response, from_json=True)
+        if res_params is not None:
+            res_params.update(response.params())
 
         # Check if this is an error. If so, print it and quit.
         if response.type() == MBotMessageType.ERROR:
@@ -97,8 +190,11 @@ class MBot(object):
 
         # If this was a response as expected, convert it to an LCM message and return.
         if response.type() == MBotMessageType.RESPONSE:
-            if ch == "HOSTNAME":
-                # Hostname is not an LCM message.
+            if response.params().get("unchanged", False):
+                # The data hasn't changed since the utime given in the request.
+                return self.UNCHANGED
+            if ch in ["HOSTNAME", "SYNC", "TIME"]:
+                # Hostname, synchronized data and the server time are not LCM messages.
                 return response.data()
             try:
                 msg = type_utils.dict_to_lcm_type(response.data(), response.dtype())
@@ -109,6 +205,108 @@ class MBot(object):
         else:
             print("[MBot API] ERROR: Got a bad response:", response.encode())
 
+    async def _request_range(self, ch, dtype, start_utime, end_utime, period=None, as_bytes=False):
+        """Internal wrapper to request a time range of data from the MBot Bridge Server.
+
+        The server streams the data back in chunks, and a final message once the range is complete.
+
+        Returns:
+            list: The messages in the range, as raw bytes if as_bytes is True or as LCM message types otherwise.
+                  Returns None if fetching the data fails.
+        """
+        req = MBotJSONRange(ch, start_utime, end_utime, period=period, dtype=dtype, as_bytes=True)
+        msgs = []
+        try:
+            async with websockets.connect(self.uri, open_timeout=self.connect_timeout) as websocket:
+                await websocket.send(req.encode())
+
+                while True:
+                    response = await websocket.recv()
+                    if isinstance(response, bytes):
+                        # Raw messages, each prefixed with its length.
+                        offset = 0
+                        while offset < len(response):
+                            size = struct.unpack_from(">I", response, offset)[0]
+                            msgs.append(response[offset + 4:offset + 4 + size])
+                            offset += 4 + size
+                        continue
+
+                    response = MBotJSONMessage(response, from_json=True)
+                    if response.type() == MBotMessageType.ERROR:
+                        print("[MBot API] ERROR:", response.data())
+                        return
+                    if response.type() == MBotMessageType.RESPONSE and response.params().get("complete", False):
+                        break
+        except asyncio.exceptions.TimeoutError:
+            print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
+            return
+
+        if as_bytes:
+            return msgs
+
+        try:
+            msgs = [type_utils.decode(msg, dtype) for msg in msgs]
+        except type_utils.BadMessageError as e:
+            print("[MBot API] ERROR:", e)
+            return
+
+        return msgs
+
+    async def _sync_time(self, samples):
+        best = None
+        try:
+            async with websockets.connect(self.uri, open_timeout=self.connect_timeout) as websocket:
+                for _ in range(samples):
+                    start_utime = time.time_ns() // 1000
+                    await websocket.send(MBotJSONRequest("TIME").encode())
+                    response = await websocket.recv()
+                    end_utime = time.time_ns() // 1000
+
+                    res = self._process_response(response, "TIME")
+                    if res is None:
+                        return
+                    # Assume the server read its clock halfway through the round trip.
+                    rtt = end_utime - start_utime
+                    if best is None or rtt < best[1]:
+                        best = (res["utime"] - (start_utime + end_utime) // 2, rtt)
+        except asyncio.exceptions.TimeoutError:
+            print(f"[MBot API] ERROR: Cannot connect to MBot Bridge at: {self.uri}")
+            return
+
+        return best
+
+    def sync_time(self, samples=5):
+        """Estimates the offset from this computer's clock to the server's, and the round trip time to the server.
+        The sample with the shortest round trip is used, since it is the least affected by delays. Once the offset is
+        known, the age of the messages read is computed (see latency()).
+
+        Args:
+            samples (int, optional): The number of time requests to send. Defaults to 5.
+
+        Returns:
+            tuple: The clock offset and the round trip time, in seconds. The offset is positive if the server's clock is
+                   ahead. Returns None for both if the server can't be reached.
+        """
+        res = asyncio.run(self._sync_time(samples))
+        if res is None:
+            return None, None
+
+        self._clock_offset, self._rtt = res
+        return self._clock_offset / 1e6, self._rtt / 1e6
+
+    def latency(self, channel):
+        """Gets the latency of the latest message read on a channel.
+
+        Returns:
+            dict: The "age" of the message when it was received, which is the time since its utime was set, and the
+                  "transport" latency, which is half the round trip time of the request, both in seconds. For reads
+                  which wait for new data, like read_next(), the transport latency is the time since the server
+                  received the data instead, which is only known after sync_time(), and is None before. The age is
+                  None if the message has no utime or if sync_time() has not been called. Returns None if no message
+                  has been read on the channel.
+        """
+        return self._latencies.get(channel, None)
+
     def read_hostname(self):
         res = asyncio.run(self._request("HOSTNAME"))
         if res is not None:
@@ -134,6 +332,35 @@ class MBot(object):
 
         return []
 
+    def _read_pose_at(self, channel, utime, max_extrapolation=None):
+        params = {"utime": utime}
+        if max_extrapolation is not None:
+            params.update({"max_extrapolation": max_extrapolation})
+        res = asyncio.run(self._request(channel.channel, channel.dtype,
+                                        as_bytes=False, request_as_bytes=True, params=params))
+        if res is not None:
+            return [res.x, res.y, res.theta]
+
+        return []
+
+    def read_odometry_at(self, utime, max_extrapolation=None):
+        """Reads the odometry at the given time, interpolated by the server from recent odometry. Times slightly
+        after the latest odometry are extrapolated.
+
+        Args:
+            utime (int): The time of the pose, in microseconds.
+            max_extrapolation (float, optional): The maximum time past the latest pose to extrapolate to, in seconds.
+                                                 Defaults to the server's limit.
+
+        Returns:
+            list: The odometry in format [x, y, theta], or an empty list if there is no pose at that time.
+        """
+        return self._read_pose_at(self.lcm_config.ODOMETRY, utime, max_extrapolation)
+
+    def read_slam_pose_at(self, utime, max_extrapolation=None):
+        """Reads the SLAM pose at the given time. See read_odometry_at() for details."""
+        return self._read_pose_at(self.lcm_config.SLAM_POSE, utime, max_extrapolation)
+
     def read_lidar(self):
         res = asyncio.run(self._request(self.lcm_config.LIDAR.channel,
                                         self.lcm_config.LIDAR.dtype,
@@ -143,6 +370,46 @@ class MBot(object):
 
         return [], []
 
+    def read_map(self, level=0, use_cache=True):
+        """Reads the latest SLAM map. The map is sent as raw bytes and the cells are not copied or decoded into
+        Python objects, so this is much faster than reading the map with read_data().
+
+        The last map is kept, and if the map on the server has not changed since, it is not sent again.
+
+        Args:
+            level (int, optional): Read the map downsampled by a factor of 2^level, up to 3. Defaults to 0, the full
+                                   resolution map.
+            use_cache (bool, optional): Whether to skip fetching the map if it is unchanged. Defaults to True.
+
+        Returns:
+            tuple: The cells as a 2D NumPy int8 array with shape (height, width), and a dictionary with the utime,
+                   origin_x, origin_y, meters_per_cell, width, height and num_cells of the map. The array is a read-only
+                   view over the received data, and is shared with later calls while the map is unchanged, so copy it
+                   before modifying it. Returns None and an empty dictionary if reading the map fails.
+        """
+        channel = self.lcm_config.SLAM_MAP
+        params = {"map_level": level} if level > 0 else {}
+        if use_cache and level in self._map_cache:
+            params.update({"if_newer_than": self._map_cache[level][0]})
+
+        res = asyncio.run(self._request(channel.channel, channel.dtype, as_bytes=True, request_as_bytes=True,
+                                        params=params))
+        if res is self.UNCHANGED:
+            _, cells, info = self._map_cache[level]
+            return cells, info
+        if res is None:
+            return None, {}
+
+        try:
+            info, cells = type_utils.occupancy_grid_to_array(res)
+            cells = cells.reshape(info["height"], info["width"])
+        except (type_utils.BadMessageError, ValueError) as e:
+            print("[MBot API] ERROR:", e)
+            return None, {}
+
+        self._map_cache.update({level: (info["utime"], cells, info)})
+        return cells, info
+
     def read_data(self, channel, dtype=None, as_bytes=False):
         """Reads the latest data on a given channel and returns it.
 
@@ -159,3 +426,82 @@ class MBot(object):
         """
         res = asyncio.run(self._request(channel, dtype, as_bytes=as_bytes, request_as_bytes=as_bytes))
         return res
+
+    def read_range(self, channel, dtype, start_utime, end_utime, period=None, as_bytes=False):
+        """Reads the history of a channel between two times. The server must be keeping history for the channel.
+
+        Args:
+            channel (str): The name of the channel to read the data from.
+            dtype (str): The data type of the data on the channel.
+            start_utime (int): The start of the time range, in microseconds.
+            end_utime (int): The end of the time range, in microseconds.
+            period (float, optional): If provided, at most one message is returned every period seconds.
+                                      Defaults to None.
+            as_bytes (bool, optional): Whether to return the data as raw bytes. If False, the data will be decoded as
+                                       the dtype. Defaults to False.
+
+        Returns:
+            list: The messages in the time range, oldest first. Returns an empty list if fetching the data fails.
+        """
+        res = asyncio.run(self._request_range(channel, dtype, start_utime, end_utime,
+                                              period=period, as_bytes=as_bytes))
+        if res is not None:
+            return res
+
+        return []
+
+    def read_synchronized(self, channels, tolerance=0.05):
+        """Reads the messages on several channels that are closest together in time.
+
+        Args:
+            channels (list): The channels to read. Each can be a channel name or an MBotChannel, for example
+                             [mbot.lcm_config.LIDAR, mbot.lcm_config.SLAM_POSE].
+            tolerance (float, optional): The maximum time difference between the messages, in seconds.
+                                         Defaults to 0.05.
+
+        Returns:
+            list: The messages on each channel as LCM message types, in the same order as the channels. Returns an
+                  empty list if there is no synchronized data within the tolerance.
+        """
+        channels = [ch.channel if isinstance(ch, MBotChannel) else ch for ch in channels]
+        params = {"channels": channels, "tolerance": tolerance}
+        res = asyncio.run(self._request("SYNC", as_bytes=False, request_as_bytes=True, params=params))
+        if res is None:
+            return []
+
+        msgs = []
+        for ele in res:
+            try:
+                msgs.append(type_utils.decode(base64.b64decode(ele["data"]), ele["dtype"]))
+            except type_utils.BadMessageError as e:
+                print("[MBot API] ERROR:", e)
+                return []
+
+        return msgs
+
+    def read_next(self, channel, dtype, timeout=1.0):
+        """Reads the next message on a channel. Blocks until there is a message newer than the last one returned by
+        read_next() on this channel, or, on the first call, until the next message arrives. This can be used instead
+        of calling a read function in a loop to wait for new data.
+
+        Args:
+            channel (str): The name of the channel to read the data from.
+            dtype (str): The data type of the data on the channel.
+            timeout (float, optional): The longest time to wait for new data, in seconds. Defaults to 1.0.
+
+        Returns:
+            obj: The message as an LCM message type. Returns None if there is no new data before the timeout.
+        """
+        params = {"wait": True, "timeout": timeout}
+        if channel in self._last_utimes:
+            params.update({"after_utime": self._last_utimes[channel]})
+
+        # Raw data is faster to decode, but once the clocks are synchronized, ask for JSON, which has the time the
+        # server received the data, so the transport latency can be measured (see latency()).
+        request_as_bytes = self._clock_offset is None
+        res = asyncio.run(self._request(channel, dtype, as_bytes=False, request_as_bytes=request_as_bytes,
+                                        params=params))
+        if res is not None and hasattr(res, "utime"):
+            self._last_utimes[channel] = res.utime
+
+        return res
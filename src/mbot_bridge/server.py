@@ -1,7 +1,13 @@
 #!/bin/python3
 
+import os
+import math
 import yaml
+import struct
 import asyncio
+import base64
+import itertools
+import numpy as np
 import signal
 import select
 import logging
@@ -11,32 +17,177 @@ import time
 
 import lcm
 from mbot_bridge.utils import type_utils
+from mbot_bridge.utils.history import ChannelHistory, channel_dir_name
+from mbot_bridge.utils.pose_history import PoseHistory
+from mbot_bridge.utils.reductions import MapPyramid, reduce_scan
+from mbot_bridge.utils.filters import FieldFilter, NUMERIC_TYPES
+from mbot_bridge.utils.priority import PriorityScheduler, parse_priority, CONTROL, STATE, BULK
+from mbot_bridge.utils.tracing import Tracer
 from mbot_bridge.utils.json_messages import (
-    MBotJSONMessage, MBotJSONResponse, MBotJSONError,
+    MBotJSONMessage, MBotJSONResponse, MBotJSONError, MBotRawPublish,
     MBotMessageType, BadMBotRequestError
 )
 
 
 class LCMMessageQueue(object):
-    def __init__(self, channel, dtype, queue_size=1):
+    def __init__(self, channel, dtype, queue_size=1, dormant=False, max_bytes=None):
         self.channel = channel
         self.dtype = dtype
         self.queue_size = queue_size
+        # A dormant queue only keeps the latest raw message until a client asks for the data.
+        self.dormant = dormant
+        # The most bytes of buffered messages and cached data to keep. The latest message is always kept.
+        self.max_bytes = max_bytes
 
         self._queue = []
+        self._recv_utimes = []
+        self._bytes = 0
+        self._cache_bytes = 0
         self._lock = threading.Lock()
         self._last_push_time = None
+        self._last_demand_time = time.time()
+
+        # Data computed from the latest message, shared between clients until the next message arrives.
+        self._seq = 0
+        self._cache = {}
+
+        # Condition used to wake up clients waiting for a new message. It is created in the server's event loop
+        # the first time a client waits on this channel.
+        self._cond = None
+        self._cond_loop = None
+        self._num_waiting = 0
 
     def push(self, msg):
         self._lock.acquire()
+        # Keep track of the last message time.
+        self._last_push_time = time.time()
+        self._seq += 1
+        self._cache = {}
+        self._cache_bytes = 0
         # Add the current message to the back of the queue.
         self._queue.append(msg)
+        self._recv_utimes.append(int(self._last_push_time * 1e6))
+        self._bytes += len(msg)
         # Remove old messages if necessary.
-        while len(self._queue) > self.queue_size:
-            self._queue.pop(0)
-        # Keep track of the last message time.
-        self._last_push_time = time.time()
+        queue_size = 1 if self.dormant else self.queue_size
+        while len(self._queue) > queue_size or (self.max_bytes is not None and self._bytes > self.max_bytes and
+                                                len(self._queue) > 1):
+            self._bytes -= len(self._queue.pop(0))
+            self._recv_utimes.pop(0)
+        self._lock.release()
+
+        # Wake up anyone waiting for new data. This is called from the LCM thread, so the notification is run in the
+        # event loop the waiting clients are on.
+        if self._num_waiting > 0:
+            try:
+                asyncio.run_coroutine_threadsafe(self._notify_waiting(), self._cond_loop)
+            except RuntimeError:
+                # The event loop has been closed.
+                pass
+
+    async def _notify_waiting(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def seq(self):
+        # The number of messages pushed so far.
+        self._lock.acquire()
+        seq = self._seq
+        self._lock.release()
+        return seq
+
+    async def wait_for(self, predicate, timeout):
+        """Waits until predicate() is true, checking each time a new message arrives. Must be called from the server's
+        event loop. Returns False if the timeout expired first."""
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+            self._cond_loop = asyncio.get_running_loop()
+
+        # Count this client as waiting before checking the predicate, so that no new message is missed.
+        self._num_waiting += 1
+        try:
+            async with self._cond:
+                await asyncio.wait_for(self._cond.wait_for(predicate), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._num_waiting -= 1
+
+    def cached(self, key, compute):
+        """Returns compute(latest) for the latest raw message. The result is stored until the next message arrives,
+        so compute is only called once per message for each key."""
+        self._lock.acquire()
+        seq = self._seq
+        latest = self._queue[-1] if len(self._queue) > 0 else None
+        hit = self._cache.get(key, None)
+        self._lock.release()
+
+        if hit is not None:
+            return hit
+
+        res = compute(latest)
+        size = len(res) if isinstance(res, (bytes, str)) else 0
+
+        self._lock.acquire()
+        # Only store the result if no new message arrived in the meantime, and if it fits in the budget.
+        fits = self.max_bytes is None or self._bytes + self._cache_bytes + size <= self.max_bytes
+        if self._seq == seq and fits:
+            self._cache[key] = res
+            self._cache_bytes += size
         self._lock.release()
+        return res
+
+    def nbytes(self):
+        # The bytes used by buffered messages and cached data.
+        self._lock.acquire()
+        nbytes = self._bytes + self._cache_bytes
+        self._lock.release()
+        return nbytes
+
+    def evict_cache(self):
+        """Drops all the cached data. Returns the number of bytes freed."""
+        self._lock.acquire()
+        freed = self._cache_bytes
+        self._cache = {}
+        self._cache_bytes = 0
+        self._lock.release()
+        return freed
+
+    def evict_old(self):
+        """Drops all the buffered messages except the latest. Returns the number of bytes freed."""
+        self._lock.acquire()
+        freed = sum(len(msg) for msg in self._queue[:-1])
+        del self._queue[:-1]
+        del self._recv_utimes[:-1]
+        self._bytes -= freed
+        self._lock.release()
+        return freed
+
+    def last_demand(self):
+        self._lock.acquire()
+        last_demand = self._last_demand_time
+        self._lock.release()
+        return last_demand
+
+    def demand(self):
+        # Keep track of the last time a client asked for this data.
+        self._lock.acquire()
+        self._last_demand_time = time.time()
+        self._lock.release()
+
+    def idle(self, idle_timeout):
+        self._lock.acquire()
+        idle = time.time() - self._last_demand_time > idle_timeout
+        self._lock.release()
+        return idle
+
+    def sleep(self):
+        # Go back to only storing the latest raw message.
+        self._lock.acquire()
+        self.dormant = True
+        self._lock.release()
+        self.evict_old()
 
     def latest(self, decode=True):
         latest = None
@@ -61,21 +212,49 @@ class LCMMessageQueue(object):
             latest = self._queue[-1]
         self._lock.release()
 
-        # Grab the utime.
+        # Grab the utime, reading it directly from the raw data where possible.
         if self.dtype is not None:
-            latest = type_utils.decode(latest, self.dtype)
-            if hasattr(latest, "utime"):
-                return latest.utime
+            utime = type_utils.read_utime(latest, self.dtype)
+            if utime is not None:
+                return utime
 
         # If the time can't be decoded from the message, use the last push time.
         latest_utime = int(self._last_push_time * 1e6)
         return latest_utime
 
+    def latest_recv_utime(self):
+        # The time the latest message was received by the server, in microseconds.
+        self._lock.acquire()
+        recv_utime = self._recv_utimes[-1] if len(self._recv_utimes) > 0 else None
+        self._lock.release()
+        return recv_utime
+
+    def stamped(self):
+        """Returns a list of (utime, data) pairs for all the raw messages in the queue, oldest first. If the utime
+        can't be read from a message, the time it was received is used."""
+        self._lock.acquire()
+        queue, recv_utimes = list(self._queue), list(self._recv_utimes)
+        self._lock.release()
+
+        stamped = []
+        for data, recv_utime in zip(queue, recv_utimes):
+            utime = None
+            if self.dtype is not None:
+                try:
+                    utime = type_utils.read_utime(data, self.dtype)
+                except (type_utils.BadMessageError, ValueError):
+                    pass
+            stamped.append((utime if utime is not None else recv_utime, data))
+
+        return stamped
+
     def pop(self, decode=False):
         first = None
         self._lock.acquire()
         if len(self._queue) > 0:
             first = self._queue.pop(0)
+            self._recv_utimes.pop(0)
+            self._bytes -= len(first)
         self._lock.release()
 
         # Decode to LCM type if requested.
@@ -88,9 +267,16 @@ class LCMMessageQueue(object):
         return len(self._queue) == 0
 
     def header(self):
+        self._lock.acquire()
+        buffered_bytes, cached_bytes = self._bytes, self._cache_bytes
+        self._lock.release()
         return {"channel": self.channel,
                 "dtype": self.dtype,
-                "queue_size": self.queue_size}
+                "queue_size": self.queue_size,
+                "dormant": self.dormant,
+                "buffered_bytes": buffered_bytes,
+                "cached_bytes": cached_bytes,
+                "max_bytes": self.max_bytes}
 
     def active(self, stale_threshold=10):
         self._lock.acquire()
@@ -103,16 +289,92 @@ class LCMMessageQueue(object):
 
 
 class MBotBridgeServer(object):
+    # Request parameters for reducing the resolution of lidar and map data.
+    REDUCTION_PARAMS = ["lidar_bins", "lidar_decimate", "map_level"]
+    # Number of downsampled map levels available, at 2x, 4x, 8x, ... lower resolution.
+    MAP_LEVELS = 3
+    # Largest number of lidar bins, or lidar decimation factor, a client can ask for.
+    MAX_LIDAR_RAYS = 3600
+    # Longest time a client can wait for new data, in seconds.
+    MAX_WAIT_TIMEOUT = 30
+    # Number of messages sent per response when streaming a range request.
+    RANGE_CHUNK_SIZE = 50
+    # Default maximum time difference between synchronized messages, in seconds.
+    SYNC_TOLERANCE = 0.05
+    # Orders in which channels give up memory when the buffers are over budget.
+    EVICTION_POLICIES = ["largest", "lru"]
+    # Channels which carry robot commands, handled before all other traffic by default.
+    DEFAULT_CONTROL_CHANNELS = ["MBOT_VEL_CMD", "MBOT_ODOMETRY_RESET", "CONTROLLER_PATH"]
+    # Types which are large enough to be sent as bulk data by default.
+    BULK_TYPES = ["occupancy_grid_t"]
+
     def __init__(self, lcm_address, subs,
                  ignore_channels=[], map_channel="SLAM_MAP",
-                 lcm_type_modules=["mbot_lcm_msgs"], lcm_timeout=1000,
-                 hostfile="/etc/hostname", discard_msgs=-1, stale_channel_timeout=10):
+                 lcm_type_modules=["mbot_lcm_msgs"], type_cache=None, lcm_timeout=1000,
+                 hostfile="/etc/hostname", discard_msgs=-1, stale_channel_timeout=10, queue_size=1,
+                 pose_history_size=100, max_extrapolation=0.2,
+                 history_dir=None, history_channels=None, history_max_bytes=64 * 1024 * 1024,
+                 history_segment_bytes=4 * 1024 * 1024, lazy_channels=False, channel_idle_timeout=60,
+                 trace_file=None, trace_sample_rate=0.01,
+                 max_buffer_bytes=None, channel_max_bytes=None, eviction_policy="largest",
+                 control_channels=DEFAULT_CONTROL_CHANNELS, bulk_channels=[], bulk_chunk_size=64 * 1024):
         self._hostname = self._read_hostname(hostfile)
         self._loop = None
         self._map_channel = map_channel
         self.lcm_type_modules = lcm_type_modules
+        # Looks up the types of channels from their data. The packages are only scanned once the first channel
+        # without a known type is found, if the cache is out of date.
+        self._type_registry = type_utils.TypeRegistry(lcm_type_modules, cache_file=type_cache)
         self.discard_msgs = discard_msgs
         self.stale_channel_timeout = stale_channel_timeout
+        self.queue_size = queue_size
+
+        # In lazy mode, channels found by listening to all channels stay dormant until a client asks for them.
+        self.lazy_channels = lazy_channels
+        self.channel_idle_timeout = channel_idle_timeout
+        self._lazy = set()
+        self._last_idle_check = time.time()
+
+        # Pose history setup, used to look up the pose at a given time on pose channels.
+        self.pose_history_size = pose_history_size
+        self.max_extrapolation = max_extrapolation
+        self._pose_histories = {}
+
+        # History setup. If no directory is given, no history is kept.
+        self.history_dir = history_dir
+        self.history_channels = history_channels
+        self.history_max_bytes = history_max_bytes
+        self.history_segment_bytes = history_segment_bytes
+        self._histories = {}
+        if self.history_dir is not None:
+            logging.info(f"Keeping channel history in: {self.history_dir}")
+
+        # Memory budgets for the buffered messages and cached data. If None, there is no limit.
+        if eviction_policy not in self.EVICTION_POLICIES:
+            raise Exception(f"Unknown eviction policy: {eviction_policy}")
+        self.max_buffer_bytes = max_buffer_bytes
+        self.channel_max_bytes = channel_max_bytes
+        self.eviction_policy = eviction_policy
+        self._channel_budgets = {}
+        self._over_budget = False
+
+        # Priority setup. Large bulk messages are sent in chunks which yield to control and state messages. If the
+        # chunk size is 0, all messages are handled in the order they arrive.
+        self._channel_priorities = {ch: CONTROL for ch in control_channels}
+        self._channel_priorities.update({ch: BULK for ch in bulk_channels})
+        self._conn_priorities = {}
+        self._scheduler = PriorityScheduler(bulk_chunk_size)
+        self._bulk_sending = set()
+        self._bulk_pending = {}
+        self._bulk_lock = threading.Lock()
+        self._main_loop = None
+
+        # Tracing setup. If no trace file is given, nothing is traced.
+        self.trace_file = trace_file
+        self._tracer = None
+        if self.trace_file is not None and trace_sample_rate > 0:
+            logging.info(f"Tracing {trace_sample_rate * 100}% of messages to: {self.trace_file}")
+            self._tracer = Tracer("mbot_bridge.server", sample_rate=trace_sample_rate)
 
         # LCM setup.
         self._lcm_timeout = lcm_timeout  # This is how long to timeout in the LCM handle call.
@@ -123,6 +385,9 @@ class MBotBridgeServer(object):
 
         self._msg_managers = {}
         self._subs = {}
+        self._sub_params = {}
+        self._sub_filters = {}
+        self._map_pyramids = {}
         self._ignore_channels = ignore_channels
 
         if isinstance(subs, list):
@@ -130,11 +395,17 @@ class MBotBridgeServer(object):
             logging.info("Listening to only provided channels.")
             for channel in subs:
                 ch, lcm_type = channel["channel"], channel["type"]
+                if "max_mb" in channel:
+                    self._channel_budgets.update({ch: int(channel["max_mb"] * 1024 * 1024)})
+                if "priority" in channel:
+                    self._channel_priorities.update({ch: parse_priority(channel["priority"])})
                 self._init_channel(ch, lcm_type=lcm_type)
                 self._lcm.subscribe(ch, self.listener)
         elif subs == 'all':
             # Listen to all the available channels.
             logging.info("Listening to all published channels.")
+            if self.lazy_channels:
+                logging.info("Channels will be activated when a client requests them.")
             self._lcm.subscribe(".*", self.listener)
         else:
             logging.error(f"Cannot interpret subs configuration: {subs}")
@@ -156,6 +427,12 @@ class MBotBridgeServer(object):
                 if ws.open:
                     await ws.close()
 
+        for _, history in self._histories.items():
+            history.close()
+
+        if self._tracer is not None:
+            self._tracer.export(self.trace_file)
+
     def running(self):
         self._lock.acquire()
         res = self._running
@@ -173,13 +450,17 @@ class MBotBridgeServer(object):
 
         return name.strip()
 
-    def _latest_as_msg(self, ch, decode=True):
+    def _latest_as_msg(self, ch, decode=True, trace=None):
         try:
             latest = self._msg_managers[ch].latest(decode)
+            if trace is not None:
+                trace.mark("decode")
             if decode:
                 latest = type_utils.lcm_type_to_dict(latest)  # Convert to dictionary, only message is decoded.
+                if trace is not None:
+                    trace.mark("to_dict")
             # Wrap the response data for sending over the websocket.
-            res = MBotJSONResponse(latest, ch, self._msg_managers[ch].dtype)
+            res = MBotJSONResponse(latest, ch, self._msg_managers[ch].dtype, params=self._recv_params(ch))
         except type_utils.BadMessageError as e:
             # If we were asked to decode an unknown type, return an error.
             msg = f"Can't decode data on channel {ch}: {e}"
@@ -187,6 +468,30 @@ class MBotBridgeServer(object):
             res = MBotJSONError(msg)
         return res
 
+    def _recv_params(self, ch, params=None):
+        # Response parameters with the time the data was received, so clients can tell how long it took to reach them.
+        params = dict(params) if params is not None else {}
+        params.update({"recv_utime": self._msg_managers[ch].latest_recv_utime()})
+        return params
+
+    def _encode_latest(self, ch, trace=None):
+        res = self._latest_as_msg(ch, decode=True, trace=trace).encode()
+        if trace is not None:
+            trace.mark("json")
+        return res
+
+    def _start_trace(self, channel, data):
+        trace = self._tracer.start(channel, "subscribe")
+        if trace is None:
+            return None
+
+        # Start the trace from when the message was published, if the message time looks like it was set by this
+        # machine's clock.
+        start_ns = self._msg_utime(channel, data) * 1000
+        if 0 <= trace.start_ns - start_ns < 10e9:
+            trace.set_start(start_ns)
+        return trace
+
     def _init_channel(self, channel, lcm_type=None, data=None):
         # If we already have this channel, return success.
         if channel in self._msg_managers.keys():
@@ -196,6 +501,16 @@ class MBotBridgeServer(object):
         if channel in self._ignore_channels:
             return False
 
+        # In lazy mode, store the channel without looking for its type until a client asks for it.
+        if lcm_type is None and self.lazy_channels:
+            logging.info(f"Found channel: {channel} (dormant)")
+            self._lazy.add(channel)
+            self._subs.update({channel: []})
+            self._msg_managers.update({channel: LCMMessageQueue(channel, None, queue_size=self.queue_size,
+                                                                dormant=True,
+                                                                max_bytes=self._channel_budget(channel))})
+            return True
+
         # If the user did not specify a channel, try to find it.
         if lcm_type is None:
             if data is None:
@@ -203,7 +518,7 @@ class MBotBridgeServer(object):
                 return False
 
             try:
-                lcm_type = type_utils.find_lcm_type(data, self.lcm_type_modules)
+                lcm_type = self._type_registry.find(data)
             except type_utils.BadMessageError as e:
                 logging.warning(f"Can't find a valid message type for channel: {channel}. "
                                 "Data will be stored but can't be decoded.")
@@ -213,9 +528,104 @@ class MBotBridgeServer(object):
         lcm_type_to_print = lcm_type if lcm_type is not None else "unknown type"
         logging.info(f"Listening on channel: {channel} ({lcm_type_to_print})")
         self._subs.update({channel: []})
-        self._msg_managers.update({channel: LCMMessageQueue(channel, lcm_type)})
+        self._msg_managers.update({channel: LCMMessageQueue(channel, lcm_type, queue_size=self.queue_size,
+                                                            max_bytes=self._channel_budget(channel))})
+        self._init_channel_data(channel)
         return True
 
+    def _channel_budget(self, channel):
+        return self._channel_budgets.get(channel, self.channel_max_bytes)
+
+    def _enforce_budget(self):
+        # If the buffers on all the channels use more than the budget, free memory until they fit.
+        total = sum(queue.nbytes() for queue in self._msg_managers.values())
+        if total <= self.max_buffer_bytes:
+            self._over_budget = False
+            return
+
+        if self.eviction_policy == "lru":
+            # Channels which clients asked for least recently give up memory first.
+            order = sorted(self._msg_managers.values(), key=lambda queue: queue.last_demand())
+        else:
+            order = sorted(self._msg_managers.values(), key=lambda queue: queue.nbytes(), reverse=True)
+
+        # Cached data is dropped first since it can be computed again, then older buffered messages.
+        for evict in [lambda queue: queue.evict_cache(), lambda queue: queue.evict_old()]:
+            for queue in order:
+                total -= evict(queue)
+                if total <= self.max_buffer_bytes:
+                    return
+
+        # The latest message on each channel is always kept, so the budget can't be met.
+        if not self._over_budget:
+            logging.warning(f"The latest messages on all channels use {total} bytes, which is over the buffer budget "
+                            f"of {self.max_buffer_bytes} bytes.")
+        self._over_budget = True
+
+    def _init_channel_data(self, channel):
+        # Set up any data kept for the channel beyond the latest messages.
+        self._init_history(channel)
+        lcm_type = self._msg_managers[channel].dtype
+        if lcm_type is not None and lcm_type.split(".")[-1] == "pose2D_t" and self.pose_history_size > 0:
+            self._pose_histories.update({channel: PoseHistory(self.pose_history_size)})
+
+    def _demand_channel(self, channel):
+        # A client wants the data on this channel. If it is dormant, wake it up.
+        queue = self._msg_managers[channel]
+        queue.demand()
+        if not queue.dormant:
+            return
+
+        if queue.dtype is None and not queue.empty():
+            try:
+                queue.dtype = self._type_registry.find(queue.latest(decode=False))
+            except type_utils.BadMessageError:
+                logging.warning(f"Can't find a valid message type for channel: {channel}. "
+                                "Data will be stored but can't be decoded.")
+
+        lcm_type_to_print = queue.dtype if queue.dtype is not None else "unknown type"
+        logging.info(f"Listening on channel: {channel} ({lcm_type_to_print})")
+        self._init_channel_data(channel)
+        queue.dormant = False
+
+    def _sleep_idle_channels(self):
+        # Put any lazy channels which no client has asked for recently back to sleep.
+        for channel in list(self._lazy):
+            queue = self._msg_managers[channel]
+            if queue.dormant or len(self._subs[channel]) > 0 or not queue.idle(self.channel_idle_timeout):
+                continue
+
+            logging.info(f"Channel idle, no longer listening: {channel}")
+            queue.sleep()
+            history = self._histories.pop(channel, None)
+            if history is not None:
+                history.close()
+            self._pose_histories.pop(channel, None)
+
+    def _init_history(self, channel):
+        if self.history_dir is None:
+            return
+        if self.history_channels is not None and channel not in self.history_channels:
+            return
+
+        path = os.path.join(self.history_dir, channel_dir_name(channel))
+        logging.info(f"Recording history for channel: {channel} ({path})")
+        self._histories.update({channel: ChannelHistory(channel, path, max_bytes=self.history_max_bytes,
+                                                        segment_bytes=self.history_segment_bytes)})
+
+    def _msg_utime(self, channel, data):
+        # Use the message time if the type has one, otherwise use the time the message was received.
+        dtype = self._msg_managers[channel].dtype
+        if dtype is not None:
+            try:
+                utime = type_utils.read_utime(data, dtype)
+                if utime is not None:
+                    return utime
+            except (type_utils.BadMessageError, ValueError):
+                pass
+
+        return time.time_ns() // 1000
+
     def listener(self, channel, data):
         # Ignore any data on an ignore channel.
         if channel in self._ignore_channels:
@@ -227,17 +637,58 @@ class MBotBridgeServer(object):
                 return
 
         self._msg_managers[channel].push(data)
+        if self.max_buffer_bytes is not None:
+            self._enforce_budget()
+
+        # Dormant channels only store the latest message.
+        if self._msg_managers[channel].dormant:
+            return
+
+        if channel in self._histories:
+            self._histories[channel].append(self._msg_utime(channel, data), data)
+
+        if channel in self._pose_histories:
+            try:
+                pose = type_utils.decode(data, self._msg_managers[channel].dtype)
+                self._pose_histories[channel].push(pose.utime, pose.x, pose.y, pose.theta)
+            except (type_utils.BadMessageError, ValueError) as e:
+                logging.debug(f"Can't add pose on channel {channel} to history: {e}")
 
         # If there are subscribers, send them the data.
         if len(self._subs[channel]) > 0:
-            res = self._latest_as_msg(channel, decode=True)
+            trace = self._start_trace(channel, data) if self._tracer is not None else None
+            if trace is not None:
+                trace.mark("lcm")
+
             for ws_sub in self._subs[channel]:
                 if not ws_sub.open:
                     self._subs[channel].remove(ws_sub)
                     continue
 
+                reduce_params = self._sub_params.get((channel, ws_sub.id), ())
+                field_filter = self._sub_filters.get((channel, ws_sub.id), None)
+                if field_filter is not None:
+                    res = self._filtered_msg(channel, field_filter)
+                    if res is None:
+                        # The data hasn't changed enough to send to this client.
+                        continue
+                elif len(reduce_params) > 0:
+                    res = self._reduced_msg(channel, reduce_params)
+                else:
+                    res = self._msg_managers[channel].cached(("latest",),
+                                                             lambda _: self._encode_latest(channel, trace))
+
+                if self._priority(channel, ws_sub.id) == BULK and self._scheduler.enabled() and \
+                        self._main_loop is not None:
+                    # Bulk data is sent from the server's event loop, so it can yield to urgent messages without
+                    # holding up the data on other channels.
+                    self._send_bulk_threadsafe(ws_sub, channel, res)
+                    continue
+
                 try:
-                    self._loop.run_until_complete(ws_sub.send(res.encode()))
+                    self._loop.run_until_complete(ws_sub.send(res))
+                    if trace is not None:
+                        trace.mark("send")
                 except (websockets.exceptions.ConnectionClosedOK,
                         websockets.exceptions.ConnectionClosedError,
                         RuntimeError):
@@ -245,6 +696,53 @@ class MBotBridgeServer(object):
                     logging.debug(f"Websocket ID {ws_sub.id} - Disconnected and unsubscribed from {channel}")
                     self._subs[channel].remove(ws_sub)
 
+            if trace is not None:
+                trace.finish()
+
+    def _send_bulk_threadsafe(self, ws, channel, res):
+        key = (channel, ws.id)
+        self._bulk_lock.acquire()
+        sending = key in self._bulk_sending
+        if sending:
+            # The client is still receiving an older message. Only the latest waiting message is sent after it.
+            self._bulk_pending[key] = res
+        else:
+            self._bulk_sending.add(key)
+        self._bulk_lock.release()
+
+        if not sending:
+            asyncio.run_coroutine_threadsafe(self._send_bulk(ws, key, res), self._main_loop)
+
+    async def _send_bulk(self, ws, key, res):
+        try:
+            while res is not None:
+                await self._scheduler.send(ws, res, BULK)
+
+                self._bulk_lock.acquire()
+                res = self._bulk_pending.pop(key, None)
+                if res is None:
+                    self._bulk_sending.discard(key)
+                self._bulk_lock.release()
+        except websockets.exceptions.ConnectionClosed:
+            logging.debug(f"Websocket ID {ws.id} - Disconnected while sending on channel {key[0]}")
+            self._bulk_lock.acquire()
+            self._bulk_pending.pop(key, None)
+            self._bulk_sending.discard(key)
+            self._bulk_lock.release()
+
+    def _priority(self, ch, ws_id=None):
+        # A connection can declare its own priority class. Otherwise, the class depends on the channel.
+        if ws_id in self._conn_priorities:
+            return self._conn_priorities[ws_id]
+        if ch in self._channel_priorities:
+            return self._channel_priorities[ch]
+
+        queue = self._msg_managers.get(ch, None)
+        if ch == self._map_channel or (queue is not None and queue.dtype is not None and
+                                       queue.dtype.split(".")[-1] in self.BULK_TYPES):
+            return BULK
+        return STATE
+
     def handleOnce(self):
         # This is a non-blocking handle, which only calls handle if a message is ready.
         rfds, wfds, efds = select.select([self._lcm.fileno()], [], [], 0)
@@ -259,16 +757,155 @@ class MBotBridgeServer(object):
             # the non-blocking handleOnce.
             self._lcm.handle_timeout(self._lcm_timeout)
 
-    def _subscribe(self, ws, channel):
+            if self.lazy_channels and time.time() - self._last_idle_check > min(self.channel_idle_timeout, 1):
+                self._sleep_idle_channels()
+                self._last_idle_check = time.time()
+
+    def _subscribe(self, ws, channel, reduce_params=(), field_filter=None):
+        self._sub_params[(channel, ws.id)] = reduce_params
+        if field_filter is not None:
+            self._sub_filters[(channel, ws.id)] = field_filter
         self._subs[channel].append(ws)
 
     async def _unsubscribe(self, ws, channel=None):
         await ws.close()
         self._subs[channel].remove(ws)
+        self._sub_params.pop((channel, ws.id), None)
+        self._sub_filters.pop((channel, ws.id), None)
+
+    def _reduction_params(self, params):
+        # Validates the reduction parameters and returns them in a form which can be used as a cache key.
+        try:
+            reduce_params = tuple((k, int(params[k])) for k in self.REDUCTION_PARAMS if params.get(k) is not None)
+        except OverflowError as e:
+            raise ValueError(e)
+        for k, val in reduce_params:
+            if k in ["lidar_bins", "lidar_decimate"] and not 1 <= val <= self.MAX_LIDAR_RAYS:
+                raise ValueError(f"{k} must be between 1 and {self.MAX_LIDAR_RAYS}")
+        return reduce_params
+
+    def _filter_params(self, ch, params):
+        # Validates the field projection and deadband parameters. Returns None if there are none.
+        fields, deadband = params.get("fields"), params.get("deadband")
+        if fields is None and deadband is None:
+            return None
+        if len(self._reduction_params(params)) > 0:
+            raise ValueError("fields and deadband can't be combined with reductions")
+
+        dtype = self._msg_managers[ch].dtype
+        try:
+            lcm_type = type_utils.str_to_lcm_type(dtype) if dtype is not None else None
+        except (AttributeError, ModuleNotFoundError):
+            lcm_type = None
+        if lcm_type is None:
+            raise ValueError(f"unknown data type on channel {ch}")
+
+        if isinstance(fields, str):
+            fields = fields.split(",")
+        if fields is not None:
+            if not isinstance(fields, list) or not all(isinstance(f, str) for f in fields):
+                raise TypeError("fields must be a list of strings or a comma separated string")
+            fields = [f.strip() for f in fields]
+            unknown = [f for f in fields if f not in lcm_type.__slots__]
+            if len(unknown) > 0:
+                raise ValueError(f"no fields {unknown} in {dtype}")
+
+        if isinstance(deadband, dict):
+            numeric = [k for k, t in zip(lcm_type.__slots__, lcm_type.__typenames__) if t in NUMERIC_TYPES]
+            deadband = {k: float(v) for k, v in deadband.items()}
+            unknown = [k for k in deadband if k not in numeric]
+            if len(unknown) > 0:
+                raise ValueError(f"no numeric fields {unknown} in {dtype}")
+        elif deadband is not None:
+            deadband = float(deadband)
+
+        return FieldFilter(fields, deadband)
+
+    def _filtered_msg(self, ch, field_filter):
+        # The message is decoded once for all the clients, and each set of fields is only encoded once. Returns None
+        # if the message doesn't pass the filter's deadband.
+        queue = self._msg_managers[ch]
+        try:
+            data = queue.cached(("dict",), lambda raw: type_utils.lcm_type_to_dict(type_utils.decode(raw, queue.dtype)))
+        except (type_utils.BadMessageError, ValueError) as e:
+            msg = f"Can't decode data on channel {ch}: {e}"
+            logging.warning(msg)
+            return MBotJSONError(msg).encode()
+
+        if not field_filter.passes(data):
+            return None
+        return queue.cached(("fields", field_filter.fields),
+                            lambda _: MBotJSONResponse(field_filter.project(data), ch, queue.dtype,
+                                                       params=self._recv_params(ch)).encode())
+
+    def _reduced_msg(self, ch, reduce_params, as_bytes=False):
+        # The reduced data is cached so it is only computed once per message for all the clients.
+        return self._msg_managers[ch].cached(("reduced", as_bytes, reduce_params),
+                                             lambda raw: self._reduce(ch, raw, dict(reduce_params), as_bytes))
+
+    def _reduce(self, ch, raw, reduce_params, as_bytes):
+        dtype = self._msg_managers[ch].dtype
+        type_name = dtype.split(".")[-1] if dtype is not None else None
+
+        if "map_level" in reduce_params:
+            level = reduce_params["map_level"]
+            if type_name != "occupancy_grid_t" or not 0 <= level <= self.MAP_LEVELS:
+                msg = f"Can't get map level {level} on channel {ch} ({dtype})."
+                logging.warning(msg)
+                return MBotJSONError(msg).encode()
+
+            try:
+                header, cells = type_utils.occupancy_grid_to_array(raw)
+            except (type_utils.BadMessageError, ValueError) as e:
+                msg = f"Can't decode data on channel {ch}: {e}"
+                logging.warning(msg)
+                return MBotJSONError(msg).encode()
+
+            # The pyramid is updated incrementally from the last map.
+            if ch not in self._map_pyramids:
+                self._map_pyramids.update({ch: MapPyramid(self.MAP_LEVELS)})
+            pyramid = self._map_pyramids[ch]
+            pyramid.update(cells, header["width"], header["height"])
+            grid = pyramid.level(level)
+            header.update({"meters_per_cell": header["meters_per_cell"] * 2**level,
+                           "height": grid.shape[0], "width": grid.shape[1], "num_cells": grid.size})
+            if as_bytes:
+                return type_utils.array_to_occupancy_grid(header, grid)
+
+            header.update({"cells": base64.b64encode(grid.tobytes()).decode("utf-8")})
+            return MBotJSONResponse(header, ch, dtype, params=self._recv_params(ch, {"map_level": level})).encode()
+
+        if type_name != "lidar_t":
+            msg = f"Can't reduce lidar data on channel {ch} ({dtype})."
+            logging.warning(msg)
+            return MBotJSONError(msg).encode()
+
+        try:
+            scan = reduce_scan(type_utils.decode(raw, dtype), bins=reduce_params.get("lidar_bins"),
+                               decimate=reduce_params.get("lidar_decimate"))
+        except (type_utils.BadMessageError, ValueError) as e:
+            msg = f"Can't decode data on channel {ch}: {e}"
+            logging.warning(msg)
+            return MBotJSONError(msg).encode()
+
+        if as_bytes:
+            scan = {k: v.tolist() if hasattr(v, "tolist") else v for k, v in scan.items()}
+            return type_utils.dict_to_lcm_type(scan, dtype).encode()
+
+        return MBotJSONResponse(scan, ch, dtype, params=self._recv_params(ch)).encode()
 
     async def process_msg(self, websocket, message):
+        if isinstance(message, bytes):
+            # Binary messages are raw LCM messages to publish.
+            await self.handle_raw_publish(websocket, message)
+            return
+
+        trace = self._tracer.start("", "request") if self._tracer is not None else None
         try:
             request = MBotJSONMessage(message, from_json=True)
+            if trace is not None:
+                trace.channel = request.channel()
+                trace.mark("parse")
         except BadMBotRequestError as e:
             # If something went wrong parsing this request, send the error message then continue.
             msg = f"Bad MBot request. Ignoring. BadMBotRequestError: {e}"
@@ -277,12 +914,44 @@ class MBotBridgeServer(object):
             await websocket.send(err.encode())
             return
 
+        if "priority" in request.params():
+            # The client set the priority of all its messages.
+            try:
+                self._conn_priorities[websocket.id] = parse_priority(request.params()["priority"])
+            except ValueError as e:
+                msg = f"Bad MBot request. {e}"
+                logging.warning(f"{websocket.id} - {msg}")
+                await websocket.send(MBotJSONError(msg).encode())
+                return
+
+        priority = self._priority(request.channel(), websocket.id)
+        await self._handle_msg(websocket, request, priority, trace)
+
+    async def _handle_msg(self, websocket, request, priority, trace=None):
         if request.type() == MBotMessageType.REQUEST:
-            res = self.handle_request(request, websocket.id)
-            if not isinstance(res, bytes):
-                # If the result is in bytes, skip the encoding and send it directly.
-                res = res.encode()
-            await websocket.send(res)
+            if request.params().get("wait", False):
+                # The client wants to wait for data newer than what it has.
+                err = await self._wait_for_data(request, websocket.id)
+                if err is not None:
+                    await websocket.send(err.encode())
+                    return
+                if trace is not None:
+                    trace.mark("wait")
+
+            # Only encoding and sending the response counts as urgent work, not waiting for the data.
+            self._scheduler.begin(priority)
+            try:
+                if priority == BULK and self._scheduler.enabled():
+                    # Bulk data can be slow to encode, so do it off the event loop.
+                    res = await asyncio.to_thread(self._respond, request, websocket.id, trace)
+                else:
+                    res = self._respond(request, websocket.id, trace)
+                await self._scheduler.send(websocket, res, priority)
+            finally:
+                self._scheduler.end(priority)
+            if trace is not None:
+                trace.mark("send")
+                trace.finish()
         elif request.type() == MBotMessageType.PUBLISH:
             try:
                 # Publish the data sent over the websocket.
@@ -305,8 +974,19 @@ class MBotBridgeServer(object):
                 err = MBotJSONError(msg)
                 await websocket.send(err.encode())
             else:
+                # Wake up the channel first, so its data type is known when checking the parameters.
+                self._demand_channel(ch)
+                try:
+                    reduce_params = self._reduction_params(request.params())
+                    field_filter = self._filter_params(ch, request.params())
+                except (TypeError, ValueError) as e:
+                    msg = f"Bad subscribe request. Bad parameters: {request.params()} ({e})"
+                    logging.warning(f"{websocket.id} - {msg}")
+                    await websocket.send(MBotJSONError(msg).encode())
+                    return
+
                 logging.debug(f"Websocket ID {websocket.id} - Subscribed to channel {request.channel()}")
-                self._subscribe(websocket, request.channel())
+                self._subscribe(websocket, request.channel(), reduce_params, field_filter)
         elif request.type() == MBotMessageType.UNSUBSCRIBE:
             ch = request.channel()
             if ch not in self._msg_managers:
@@ -318,13 +998,150 @@ class MBotBridgeServer(object):
             else:
                 logging.debug(f"Websocket ID {websocket.id} - Unsubscribed from channel {request.channel()}")
                 await self._unsubscribe(websocket, request.channel())
+        elif request.type() == MBotMessageType.RANGE:
+            await self.handle_range(websocket, request)
 
-    def handle_request(self, request, ws_id):
+    async def _wait_for_data(self, request, ws_id):
         ch = request.channel()
+        params = request.params()
+        if ch not in self._msg_managers:
+            # Let the request handler return the error.
+            return None
+
+        try:
+            after_utime = int(params["after_utime"]) if params.get("after_utime") is not None else None
+            timeout = float(params.get("timeout", self.MAX_WAIT_TIMEOUT))
+            if not math.isfinite(timeout):
+                raise ValueError("timeout must be a finite number")
+            timeout = min(timeout, self.MAX_WAIT_TIMEOUT)
+        except (TypeError, ValueError, OverflowError) as e:
+            msg = f"Bad MBot request. Bad parameters: {params} ({e})"
+            logging.warning(f"{ws_id} - {msg}")
+            return MBotJSONError(msg)
+
+        queue = self._msg_managers[ch]
+        self._demand_channel(ch)
+        if after_utime is not None:
+            # Wait for a message with a later utime than the one given.
+            def ready():
+                return not queue.empty() and queue.latest_utime() > after_utime
+        else:
+            # Wait for the next message after this request.
+            after_seq = queue.seq()
+
+            def ready():
+                return queue.seq() > after_seq
+
+        if not await queue.wait_for(ready, timeout):
+            msg = f"Timed out waiting for new data on channel: {ch}"
+            logging.debug(f"{ws_id} - {msg}")
+            return MBotJSONError(msg)
+
+        return None
+
+    async def handle_range(self, websocket, request):
+        ch = request.channel()
+        params = request.params()
+        if ch in self._msg_managers:
+            # Lazy channels only keep a history while they are awake, so wake the channel up first. Its history is
+            # loaded again from disk.
+            self._demand_channel(ch)
+        if ch not in self._histories:
+            msg = f"Bad range request. No history for channel: {ch}"
+            logging.warning(f"{websocket.id} - {msg}")
+            await websocket.send(MBotJSONError(msg).encode())
+            return
+
+        try:
+            start_utime, end_utime = int(params["start_utime"]), int(params["end_utime"])
+            period = float(params["period"]) if params.get("period") is not None else None
+            chunk_size = int(params.get("chunk_size", self.RANGE_CHUNK_SIZE))
+        except (KeyError, TypeError, ValueError) as e:
+            msg = f"Bad range request. Bad parameters: {params} ({e})"
+            logging.warning(f"{websocket.id} - {msg}")
+            await websocket.send(MBotJSONError(msg).encode())
+            return
+
+        dtype = self._msg_managers[ch].dtype
+        if not request.as_bytes() and dtype is None:
+            msg = f"Can't decode data on channel {ch}: Unknown data type."
+            logging.warning(f"{websocket.id} - {msg}")
+            await websocket.send(MBotJSONError(msg).encode())
+            return
+
+        # Messages are read from disk one chunk at a time, off the event loop.
+        msgs = self._histories[ch].range(start_utime, end_utime, period=period)
+        count, num_chunks = 0, 0
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(itertools.islice(msgs, max(chunk_size, 1))))
+            if len(chunk) == 0:
+                break
+
+            if request.as_bytes():
+                # Each raw message is prefixed with its length.
+                res = b"".join(struct.pack(">I", len(data)) + data for _, data in chunk)
+            else:
+                try:
+                    data = [type_utils.lcm_type_to_dict(type_utils.decode(data, dtype)) for _, data in chunk]
+                except type_utils.BadMessageError as e:
+                    msg = f"Can't decode data on channel {ch}: {e}"
+                    logging.warning(f"{websocket.id} - {msg}")
+                    await websocket.send(MBotJSONError(msg).encode())
+                    return
+                res = MBotJSONResponse(data, ch, dtype, params={"chunk": num_chunks}).encode()
+
+            await websocket.send(res)
+            count += len(chunk)
+            num_chunks += 1
+
+        # Let the client know the range is complete.
+        res = MBotJSONResponse(None, ch, dtype, params={"complete": True, "count": count, "chunks": num_chunks})
+        await websocket.send(res.encode())
+
+    async def handle_raw_publish(self, websocket, message):
+        try:
+            request = MBotRawPublish(message, from_json=True)
+        except BadMBotRequestError as e:
+            msg = f"Bad MBot publish. Ignoring. BadMBotRequestError: {e}"
+            logging.warning(f"{websocket.id} - {msg}")
+            await websocket.send(MBotJSONError(msg).encode())
+            return
+
+        # The data is passed to LCM as it is, so only check that it has the right type.
+        data = request.data()
+        try:
+            type_utils.check_fingerprint(data, request.dtype())
+            if request.params().get("set_utime", False):
+                data = type_utils.write_utime(data, request.dtype(), time.time_ns() // 1000)
+        except type_utils.BadMessageError as e:
+            msg = f"Bad MBot publish. Bad message type ({request.dtype()}) on channel {request.channel()}: {e}"
+            logging.warning(f"{websocket.id} - {msg}")
+            await websocket.send(MBotJSONError(msg).encode())
+            return
+
+        self._lcm.publish(request.channel(), data)
+
+    def _respond(self, request, ws_id, trace=None):
+        res = self.handle_request(request, ws_id, trace=trace)
+        if not isinstance(res, (bytes, str)):
+            # If the result is in bytes or already encoded, skip the encoding and send it directly.
+            res = res.encode()
+            if trace is not None:
+                trace.mark("json")
+        return res
+
+    def handle_request(self, request, ws_id, trace=None):
+        ch = request.channel()
+        if ch in self._msg_managers:
+            self._demand_channel(ch)
+
         if ch == "HOSTNAME":
             # If hostname, return the hostname as a string.
             res = MBotJSONResponse(self._hostname, ch, "")
             return res
+        elif ch == "TIME":
+            # If time, return the server's clock so that clients can estimate the offset from their clock.
+            return MBotJSONResponse({"utime": time.time_ns() // 1000}, ch, "")
         elif ch == "CHANNELS":
             # If channels, return the list of current subscriptions.
             subs = []
@@ -332,8 +1149,14 @@ class MBotBridgeServer(object):
                 # Only return active channels.
                 if v.active(self.stale_channel_timeout):
                     subs.append(v.header())
-            res = MBotJSONResponse(subs, ch, "")
+            # Include the memory used by all the channels, active or not.
+            usage = {"buffered_bytes": sum(queue.nbytes() for queue in self._msg_managers.values()),
+                     "max_buffer_bytes": self.max_buffer_bytes}
+            res = MBotJSONResponse(subs, ch, "", params=usage)
             return res
+        elif ch == "SYNC":
+            # If sync, return the set of messages on the requested channels closest in time.
+            return self._synchronize(request, ws_id)
         elif ch not in self._msg_managers:
             # If the channel being requested does not exist, return an error.
             msg = f"Bad MBot request. No channel: {ch}"
@@ -345,19 +1168,45 @@ class MBotBridgeServer(object):
             logging.warning(f"{ws_id} - {msg}")
             err = MBotJSONError(msg)
             return err
+        elif "utime" in request.params():
+            # The pose at a given time was requested.
+            return self._pose_at(request, ws_id)
         else:
+            try:
+                reduce_params = self._reduction_params(request.params())
+                field_filter = self._filter_params(ch, request.params())
+                if_newer_than = request.params().get("if_newer_than", None)
+                if if_newer_than is not None:
+                    if_newer_than = int(if_newer_than)
+            except (TypeError, ValueError) as e:
+                msg = f"Bad MBot request. Bad parameters: {request.params()} ({e})"
+                logging.warning(f"{ws_id} - {msg}")
+                return MBotJSONError(msg)
+
+            if if_newer_than is not None and self._msg_managers[ch].latest_utime() <= if_newer_than:
+                # The client already has the latest data, so don't send it again.
+                return MBotJSONResponse(None, ch, self._msg_managers[ch].dtype, params={"unchanged": True})
+
             # Get the newest data and send it as bytes.
-            if request.as_bytes():
+            if len(reduce_params) > 0:
+                # A reduced resolution version of the data was requested.
+                res = self._reduced_msg(ch, reduce_params, request.as_bytes())
+            elif field_filter is not None:
+                # Only some of the fields were requested. These are always sent as JSON.
+                res = self._filtered_msg(ch, field_filter)
+            elif request.as_bytes():
                 # This msg should be returned as raw bytes.
                 res = self._msg_managers[ch].latest(decode=False)
             elif ch == self._map_channel:
                 # If the map was requested, but not as bytes, use the special
                 # function to ensure the cells are returned as bytes.
-                latest = type_utils.occupancy_grid_to_byte_dict(self._msg_managers[ch].latest(False))
-                # Wrap the response data for sending over the websocket.
-                res = MBotJSONResponse(latest, ch, self._msg_managers[ch].dtype)
+                dtype = self._msg_managers[ch].dtype
+                res = self._msg_managers[ch].cached(
+                    ("map",),
+                    lambda raw: MBotJSONResponse(type_utils.occupancy_grid_to_byte_dict(raw), ch, dtype,
+                                                 params=self._recv_params(ch)).encode())
             else:
-                res = self._latest_as_msg(ch, decode=True)
+                res = self._latest_as_msg(ch, decode=True, trace=trace)
 
             if self.discard_msgs > 0:
                 message_staleness_us = time.time_ns() // 1000 - self._msg_managers[ch].latest_utime()
@@ -371,8 +1220,104 @@ class MBotBridgeServer(object):
 
             return res
 
+    def _pose_at(self, request, ws_id):
+        ch = request.channel()
+        params = request.params()
+        if ch not in self._pose_histories:
+            msg = f"Bad MBot request. No pose history on channel: {ch}"
+            logging.warning(f"{ws_id} - {msg}")
+            return MBotJSONError(msg)
+
+        try:
+            utime = int(params["utime"])
+            if not -2**63 <= utime < 2**63:
+                raise ValueError("utime must be a 64 bit integer")
+            max_extrapolation = float(params.get("max_extrapolation", self.max_extrapolation))
+            if not math.isfinite(max_extrapolation):
+                raise ValueError("max_extrapolation must be a finite number")
+            max_extrapolation = min(max_extrapolation, self.max_extrapolation)
+        except (TypeError, ValueError, OverflowError) as e:
+            msg = f"Bad MBot request. Bad parameters: {params} ({e})"
+            logging.warning(f"{ws_id} - {msg}")
+            return MBotJSONError(msg)
+
+        pose, extrapolated = self._pose_histories[ch].pose_at(utime, max_extrapolation)
+        if pose is None:
+            msg = f"No pose on channel {ch} at time {utime}."
+            logging.debug(f"{ws_id} - {msg}")
+            return MBotJSONError(msg)
+
+        dtype = self._msg_managers[ch].dtype
+        data = {"utime": utime, "x": pose[0], "y": pose[1], "theta": pose[2]}
+        if request.as_bytes():
+            return type_utils.dict_to_lcm_type(data, dtype).encode()
+
+        return MBotJSONResponse(data, ch, dtype, params={"extrapolated": extrapolated})
+
+    def _synchronize(self, request, ws_id):
+        params = request.params()
+        channels = params.get("channels", [])
+        try:
+            tolerance_us = float(params.get("tolerance", self.SYNC_TOLERANCE)) * 1e6
+        except (TypeError, ValueError):
+            tolerance_us = -1
+        if not isinstance(channels, list) or len(channels) == 0 or tolerance_us < 0 or \
+                not all(isinstance(ch, str) for ch in channels):
+            msg = f"Bad sync request. Bad parameters: {params}"
+            logging.warning(f"{ws_id} - {msg}")
+            return MBotJSONError(msg)
+
+        stamped = {}
+        for ch in channels:
+            if ch not in self._msg_managers or self._msg_managers[ch].empty():
+                msg = f"Bad sync request. No data on channel: {ch}"
+                logging.warning(f"{ws_id} - {msg}")
+                return MBotJSONError(msg)
+            self._demand_channel(ch)
+            if self._msg_managers[ch].dtype is None:
+                msg = f"Bad sync request. Can't decode data on channel: {ch} (unknown type)"
+                logging.warning(f"{ws_id} - {msg}")
+                return MBotJSONError(msg)
+            stamped[ch] = self._msg_managers[ch].stamped()
+
+        # The reference time is the latest time for which all the channels have data. For each channel, pick the
+        # buffered message closest to the reference time.
+        ref_utime = min(msgs[-1][0] for msgs in stamped.values())
+        selected = {}
+        for ch, msgs in stamped.items():
+            utimes = np.array([utime for utime, _ in msgs], dtype=np.int64)
+            selected[ch] = msgs[int(np.argmin(np.abs(utimes - ref_utime)))]
+
+        sel_utimes = [utime for utime, _ in selected.values()]
+        spread_us = max(sel_utimes) - min(sel_utimes)
+        if spread_us > tolerance_us:
+            msg = (f"No synchronized data on channels {channels} within tolerance "
+                   f"{tolerance_us / 1e6} s (closest: {spread_us / 1e6} s).")
+            logging.debug(f"{ws_id} - {msg}")
+            return MBotJSONError(msg)
+
+        data = []
+        for ch in channels:
+            utime, raw = selected[ch]
+            dtype = self._msg_managers[ch].dtype
+            if request.as_bytes():
+                # Raw data is base64 encoded to fit in the JSON response.
+                msg_data = base64.b64encode(raw).decode("utf-8")
+            else:
+                try:
+                    msg_data = type_utils.lcm_type_to_dict(type_utils.decode(raw, dtype))
+                except type_utils.BadMessageError as e:
+                    msg = f"Can't decode data on channel {ch}: {e}"
+                    logging.warning(f"{ws_id} - {msg}")
+                    return MBotJSONError(msg)
+            data.append({"channel": ch, "dtype": dtype, "utime": utime, "data": msg_data})
+
+        return MBotJSONResponse(data, "SYNC", "", params={"utime": ref_utime, "spread": spread_us})
+
     async def handler(self, websocket):
         logging.debug(f"Websocket connected with ID: {websocket.id}")
+        # Bulk subscriber data is sent from this loop.
+        self._main_loop = asyncio.get_running_loop()
 
         try:
             # Handle all incoming messages from the websocket.
@@ -383,6 +1328,17 @@ class MBotBridgeServer(object):
             logging.debug(f"Websocket connection closed: {websocket.id}")
         except websockets.exceptions.ConnectionClosedError as e:
             logging.warning(f"Websocket ID {websocket.id} - Closed with error: {e}")
+        finally:
+            self._conn_priorities.pop(websocket.id, None)
+
+
+# Where the server saves the fingerprints of the LCM types by default.
+DEFAULT_TYPE_CACHE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                                  "mbot_bridge", "lcm_types.json")
+
+
+def mb_to_bytes(mb):
+    return int(mb * 1024 * 1024) if mb is not None else None
 
 
 async def main(args):
@@ -394,9 +1350,22 @@ async def main(args):
     lcm_manager = MBotBridgeServer(args.lcm_address, subs=args.subs,
                                    ignore_channels=args.ignore_channels,
                                    map_channel=args.map_channel,
-                                   lcm_type_modules=args.lcm_type_modules,
+                                   lcm_type_modules=args.lcm_type_modules, type_cache=args.type_cache,
                                    hostfile=args.host_file, discard_msgs=args.discard_msgs,
-                                   stale_channel_timeout=args.stale_channel_timeout)
+                                   stale_channel_timeout=args.stale_channel_timeout, queue_size=args.queue_size,
+                                   pose_history_size=args.pose_history_size,
+                                   max_extrapolation=args.max_extrapolation,
+                                   history_dir=args.history_dir, history_channels=args.history_channels,
+                                   history_max_bytes=int(args.history_max_mb * 1024 * 1024),
+                                   history_segment_bytes=int(args.history_segment_mb * 1024 * 1024),
+                                   lazy_channels=args.lazy_channels,
+                                   channel_idle_timeout=args.channel_idle_timeout,
+                                   trace_file=args.trace_file, trace_sample_rate=args.trace_sample_rate,
+                                   max_buffer_bytes=mb_to_bytes(args.max_buffer_mb),
+                                   channel_max_bytes=mb_to_bytes(args.channel_max_mb),
+                                   eviction_policy=args.buffer_eviction,
+                                   control_channels=args.control_channels, bulk_channels=args.bulk_channels,
+                                   bulk_chunk_size=int(args.bulk_chunk_kb * 1024))
 
     # Not awaiting the task will cause it to be stoped when the loop ends.
     asyncio.create_task(asyncio.to_thread(lcm_manager.lcm_loop))
@@ -426,6 +1395,47 @@ def load_args(conf="config/default.yml"):
                         help="Discard stale msgs after X seconds (if -1, no messages are discarded). Default: -1")
     parser.add_argument("--stale-channel-timeout", type=float, default=10,
                         help="Timeout for marking a channel as not active.")
+    parser.add_argument("--queue-size", type=int, default=1,
+                        help="Number of messages to buffer on each channel. Larger buffers let synchronized reads "
+                             "find messages closer in time. Default: 1")
+    parser.add_argument("--pose-history-size", type=int, default=100,
+                        help="Number of poses to keep on pose channels for looking up the pose at a given time. "
+                             "If 0, no pose history is kept. Default: 100")
+    parser.add_argument("--max-extrapolation", type=float, default=0.2,
+                        help="Maximum time in seconds past the latest pose to extrapolate a pose to. Default: 0.2")
+    parser.add_argument("--lazy-channels", action="store_true",
+                        help="When listening to all channels, only decode the data on a channel once a client asks "
+                             "for it. Until then, only the latest raw message is stored.")
+    parser.add_argument("--channel-idle-timeout", type=float, default=60,
+                        help="With --lazy-channels, time in seconds after the last client request before a channel "
+                             "goes back to only storing the latest raw message. Default: 60")
+    parser.add_argument("--trace-file", type=str, default=None,
+                        help="File to write timings of the stages of handling a sample of the messages to, when the "
+                             "server exits. Files ending in .jsonl are written as JSON lines, others as Chrome traces "
+                             "(open in chrome://tracing). If not provided, nothing is traced.")
+    parser.add_argument("--trace-sample-rate", type=float, default=0.01,
+                        help="Fraction of messages to trace. Default: 0.01")
+    parser.add_argument("--max-buffer-mb", type=float, default=None,
+                        help="Maximum memory used by the buffered messages and cached data on all channels, in MB. "
+                             "When it is exceeded, cached data and then older messages are dropped, but the latest "
+                             "message on each channel is always kept. If not provided, there is no limit.")
+    parser.add_argument("--channel-max-mb", type=float, default=None,
+                        help="Maximum memory used by the buffered messages and cached data on each channel, in MB. "
+                             "Can be set per channel with the \"max_mb\" key in the config file. "
+                             "If not provided, there is no limit.")
+    parser.add_argument("--buffer-eviction", type=str, default="largest", choices=MBotBridgeServer.EVICTION_POLICIES,
+                        help="Which channels give up memory first when over --max-buffer-mb: the ones using the "
+                             "most memory (largest) or the ones least recently requested by clients (lru). "
+                             "Default: largest")
+    parser.add_argument("--control-channels", default=MBotBridgeServer.DEFAULT_CONTROL_CHANNELS, nargs='*',
+                        help="Channels with robot commands, which are handled before all other messages. "
+                             f"Default: {' '.join(MBotBridgeServer.DEFAULT_CONTROL_CHANNELS)}")
+    parser.add_argument("--bulk-channels", default=[], nargs='*',
+                        help="Channels with large data, which are sent in chunks that give way to other messages. "
+                             "By default, the map channel and channels with map types are also bulk.")
+    parser.add_argument("--bulk-chunk-kb", type=float, default=64,
+                        help="Size of the chunks bulk data is sent in, in KB. If 0, messages are handled in the "
+                             "order they arrive, regardless of priority. Default: 64")
     parser.add_argument("--ignore-channels", default=[], nargs='*',
                         help="A list of strings with channel names to ignore.")
     parser.add_argument("--map-channel", type=str, default="SLAM_MAP",
@@ -434,6 +1444,20 @@ def load_args(conf="config/default.yml"):
                         help="A list of strings with the names of Python packages to search for LCM types. "
                              "The bridge will look here to try to determine the type of a message if it was "
                              "not provided. These must be importable by the bridge.")
+    parser.add_argument("--type-cache", type=str, default=DEFAULT_TYPE_CACHE,
+                        help="File to save the fingerprints of the types in --lcm-type-modules to, so the modules "
+                             "don't need to be scanned on the next start. The file is updated when the modules "
+                             f"change. If empty, the modules are scanned every time. Default: {DEFAULT_TYPE_CACHE}")
+    parser.add_argument("--history-dir", type=str, default=None,
+                        help="Directory in which to keep a history of the channel data for range requests. "
+                             "If not provided, no history is kept.")
+    parser.add_argument("--history-channels", default=None, nargs='*',
+                        help="A list of channels to keep history for. By default, history is kept for all channels.")
+    parser.add_argument("--history-max-mb", type=float, default=64,
+                        help="Maximum size of the history kept on disk for each channel, in MB. Default: 64")
+    parser.add_argument("--history-segment-mb", type=float, default=4,
+                        help="Size of each history file on disk, in MB. The oldest file is deleted when the "
+                             "history is full. Default: 4")
 
     args = parser.parse_args()
 
@@ -447,6 +1471,9 @@ def load_args(conf="config/default.yml"):
     if "mbot_lcm_msgs" not in args.lcm_type_modules:
         args.lcm_type_modules = ["mbot_lcm_msgs"] + args.lcm_type_modules
 
+    if not args.type_cache:
+        args.type_cache = None
+
     return args
 
 
@@ -470,9 +1497,8 @@ def load_config(args):
 
 
 if __name__ == "__main__":
-    import os
     import argparse
-    import importlib
+    import importlib.util
     from . import config
     from logging import handlers
 
@@ -492,13 +1518,17 @@ if __name__ == "__main__":
     # Websocket messages are too noisy, make sure they aren't higher than warning.
     logging.getLogger("websockets").setLevel(logging.WARNING)
 
-    # Confirm that the LCM modules are loadable.
+    # Confirm that the LCM modules are loadable. They are found without being imported, since importing all the types
+    # is slow and is only needed if the type cache is out of date.
     good_type_modules = []
     for pkg in args.lcm_type_modules:
         try:
-            importlib.import_module(pkg)
+            found = importlib.util.find_spec(pkg) is not None
+        except ModuleNotFoundError:
+            found = False
+        if found:
             good_type_modules.append(pkg)
-        except ModuleNotFoundError as e:
+        else:
             logging.warning(f"No LCM type module named: \'{pkg}\'. Ignoring.")
     if len(good_type_modules) < 1:
         # If there are no valid types, add the default.
@@ -0,0 +1,57 @@
+# LCM types which are single numbers, and so can be compared with a deadband.
+NUMERIC_TYPES = ["int8_t", "int16_t", "int32_t", "int64_t", "float", "double"]
+
+
+def _is_number(val):
+    return isinstance(val, (int, float)) and not isinstance(val, bool)
+
+
+class FieldFilter(object):
+    """Selects the fields of a message sent to a client, and skips messages
+    which have barely changed since the last one sent.
+
+    The deadband is checked against the last message which was let through,
+    not the previous message, so slow drifts are still sent once they add up
+    to more than the threshold.
+    """
+
+    def __init__(self, fields=None, deadband=None):
+        """
+        Args:
+            fields (list, optional): The fields to keep. Defaults to None, which keeps all the fields.
+            deadband (float or dict, optional): Only let a message through if a numeric field changed by more than
+                                                this. If a dictionary, the threshold for each field to check. If a
+                                                number, the threshold for all the numeric fields that are kept, except
+                                                the utime. Defaults to None, which lets all messages through.
+        """
+        self.fields = tuple(fields) if fields is not None else None
+        self.deadband = deadband
+        self._last = None
+
+    def project(self, data):
+        """Returns a new dictionary with only the selected fields of the decoded message."""
+        if self.fields is None:
+            return dict(data)
+        return {k: data[k] for k in self.fields if k in data}
+
+    def _thresholds(self, data):
+        if isinstance(self.deadband, dict):
+            return self.deadband
+        keys = self.fields if self.fields is not None else data.keys()
+        return {k: self.deadband for k in keys if k != "utime" and _is_number(data.get(k))}
+
+    def passes(self, data):
+        """Whether the decoded message should be sent. If it is, it becomes the message the next ones are compared
+        to."""
+        if self.deadband is None:
+            return True
+
+        thresholds = self._thresholds(data)
+        if self._last is not None:
+            changed = any(abs(data[k] - self._last[k]) > eps for k, eps in thresholds.items()
+                          if _is_number(data.get(k)) and k in self._last)
+            if not changed:
+                return False
+
+        self._last = {k: data[k] for k in thresholds if k in data}
+        return True
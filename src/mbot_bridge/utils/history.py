@@ -0,0 +1,194 @@
+import os
+import glob
+import struct
+import threading
+import urllib.parse
+import numpy as np
+
+
+def channel_dir_name(channel):
+    """Gets the name of the directory to keep a channel's history in. Channel
+    names are percent encoded, so the name is always a single path component
+    inside the history directory, even for names like ".." or with slashes."""
+    name = urllib.parse.quote(channel, safe="")
+    if name.startswith("."):
+        # Dots are never encoded by quote(), but a leading dot would give "." or ".." or a hidden directory.
+        name = "%2E" + name[1:]
+    # An empty name is encoded as a single "%", which quote() never outputs.
+    return name if len(name) > 0 else "%"
+
+
+class ChannelHistory(object):
+    """Bounded, on-disk history of the raw LCM messages on a single channel.
+
+    Messages are appended to segment files in the channel's directory. Each
+    segment has a companion index file with one fixed-size record per message
+    (utime, offset, size), so a time range can be located from the index alone
+    and only the requested messages are read back from disk. When the total
+    size of the segments exceeds max_bytes, the oldest segments are deleted.
+    """
+
+    SEGMENT_EXT = ".seg"
+    INDEX_EXT = ".idx"
+    INDEX_DTYPE = np.dtype([("utime", ">i8"), ("offset", ">u8"), ("size", ">u4")])
+    INDEX_FORMAT = ">qQI"
+
+    def __init__(self, channel, path, max_bytes=64 * 1024 * 1024, segment_bytes=4 * 1024 * 1024):
+        self.channel = channel
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = min(segment_bytes, max_bytes)
+
+        # Closed segments, oldest first. Each is a dictionary with the keys
+        # "name", "bytes", "start_utime" and "end_utime".
+        self._segments = []
+        self._current = None
+        self._seg_file = None
+        self._idx_file = None
+        self._total_bytes = 0
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(self.path, exist_ok=True)
+        self._load_segments()
+
+    def _segment_file(self, name, ext):
+        return os.path.join(self.path, name + ext)
+
+    def _load_segments(self):
+        # Pick up any segments left over from a previous run so history is kept across restarts.
+        for seg_path in sorted(glob.glob(os.path.join(self.path, "*" + self.SEGMENT_EXT))):
+            name = os.path.basename(seg_path)[:-len(self.SEGMENT_EXT)]
+            if not name.isdecimal():
+                # Segments are always numbered, so this file wasn't written by the history. Leave it alone.
+                continue
+            try:
+                index = np.fromfile(self._segment_file(name, self.INDEX_EXT), dtype=self.INDEX_DTYPE)
+            except (FileNotFoundError, ValueError):
+                index = np.empty(0, dtype=self.INDEX_DTYPE)
+            if len(index) == 0:
+                self._remove_segment_files(name)
+                continue
+
+            seg = {"name": name, "bytes": os.path.getsize(seg_path),
+                   "start_utime": int(index["utime"].min()), "end_utime": int(index["utime"].max())}
+            self._segments.append(seg)
+            self._total_bytes += seg["bytes"]
+            self._next_id = max(self._next_id, int(name) + 1)
+
+        self._evict()
+
+    def _remove_segment_files(self, name):
+        for ext in (self.SEGMENT_EXT, self.INDEX_EXT):
+            try:
+                os.remove(self._segment_file(name, ext))
+            except FileNotFoundError:
+                pass
+
+    def _open_segment(self, utime):
+        name = f"{self._next_id:010d}"
+        self._next_id += 1
+        self._current = {"name": name, "bytes": 0, "start_utime": utime, "end_utime": utime}
+        self._seg_file = open(self._segment_file(name, self.SEGMENT_EXT), "wb")
+        self._idx_file = open(self._segment_file(name, self.INDEX_EXT), "wb")
+
+    def _close_segment(self):
+        if self._current is None:
+            return
+        self._seg_file.close()
+        self._idx_file.close()
+        self._segments.append(self._current)
+        self._current = None
+        self._seg_file, self._idx_file = None, None
+
+    def _evict(self):
+        # Remove the oldest closed segments until the history fits in the budget.
+        while self._total_bytes > self.max_bytes and len(self._segments) > 0:
+            seg = self._segments.pop(0)
+            self._remove_segment_files(seg["name"])
+            self._total_bytes -= seg["bytes"]
+
+    def append(self, utime, data):
+        self._lock.acquire()
+        # Start a new segment if the current one is full, or if time went backwards,
+        # so that the index within each segment stays sorted.
+        if self._current is not None and (self._current["bytes"] >= self.segment_bytes or
+                                          utime < self._current["end_utime"]):
+            self._close_segment()
+        if self._current is None:
+            self._open_segment(utime)
+
+        self._idx_file.write(struct.pack(self.INDEX_FORMAT, utime, self._current["bytes"], len(data)))
+        self._seg_file.write(data)
+        self._current["bytes"] += len(data)
+        self._current["end_utime"] = utime
+        self._total_bytes += len(data)
+
+        self._evict()
+        self._lock.release()
+
+    def range(self, start_utime, end_utime, period=None):
+        """Generator over the (utime, data) pairs of the messages with start_utime <= utime <= end_utime.
+
+        Args:
+            start_utime (int): Start of the time range, in microseconds.
+            end_utime (int): End of the time range, in microseconds.
+            period (float, optional): If provided, the data is downsampled so that at most one message is returned
+                                      for every period seconds. Defaults to None.
+        """
+        self._lock.acquire()
+        # Make sure everything written so far is visible to the reader.
+        if self._current is not None:
+            self._seg_file.flush()
+            self._idx_file.flush()
+            segments = self._segments + [dict(self._current)]
+        else:
+            segments = list(self._segments)
+        self._lock.release()
+
+        period_us = int(period * 1e6) if period is not None and period > 0 else None
+        last_bucket = None
+        for seg in segments:
+            if seg["end_utime"] < start_utime or seg["start_utime"] > end_utime:
+                continue
+
+            try:
+                # The index might have grown since the snapshot, but only the bytes known
+                # at the time of the snapshot are read.
+                index = np.fromfile(self._segment_file(seg["name"], self.INDEX_EXT), dtype=self.INDEX_DTYPE)
+                seg_file = open(self._segment_file(seg["name"], self.SEGMENT_EXT), "rb")
+            except FileNotFoundError:
+                # The segment was evicted while we were reading.
+                continue
+
+            with seg_file:
+                index = index[index["offset"] + index["size"] <= seg["bytes"]]
+                lo = np.searchsorted(index["utime"], start_utime, side="left")
+                hi = np.searchsorted(index["utime"], end_utime, side="right")
+                index = index[lo:hi]
+
+                if period_us is not None and len(index) > 0:
+                    # Keep the first message in every period.
+                    buckets = (index["utime"] - start_utime) // period_us
+                    _, first = np.unique(buckets, return_index=True)
+                    keep = first[buckets[first] != last_bucket] if last_bucket is not None else first
+                    last_bucket = buckets[-1]
+                    index = index[keep]
+
+                for utime, offset, size in index:
+                    seg_file.seek(int(offset))
+                    data = seg_file.read(int(size))
+                    if len(data) < size:
+                        break
+                    yield int(utime), data
+
+    def size(self):
+        self._lock.acquire()
+        res = self._total_bytes
+        self._lock.release()
+        return res
+
+    def close(self):
+        self._lock.acquire()
+        self._close_segment()
+        self._lock.release()
@@ -1,5 +1,58 @@
 import json
-import numpy as np
+import struct
+from mbot_bridge.utils.lazy import LazyModule
+
+# NumPy is only needed to serialize arrays, so it is only imported when one is sent.
+np = LazyModule("numpy")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class JSONSerializer(object):
+    """Serializes messages with the standard library json module. NumPy arrays are converted to lists."""
+    name = "json"
+
+    def dumps(self, msg):
+        return json.dumps(msg, default=self._default)
+
+    def loads(self, data):
+        return json.loads(data)
+
+    @staticmethod
+    def _default(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrjsonSerializer(JSONSerializer):
+    """Serializes messages with orjson, which writes NumPy arrays directly."""
+    name = "orjson"
+
+    def dumps(self, msg):
+        # Messages are sent as text, so return a string like json.dumps().
+        return orjson.dumps(msg, default=self._default, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def get_serializer(name=None):
+    """Gets a serializer by name ("json" or "orjson"). By default, uses the fastest one installed."""
+    if name is None:
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("Serializer orjson was requested but it is not installed.")
+        return OrjsonSerializer()
+    if name == "json":
+        return JSONSerializer()
+    raise ValueError(f"Unknown serializer: {name}")
 
 
 class MBotMessageType(object):
@@ -9,6 +62,7 @@ class MBotMessageType(object):
     RESPONSE = 2
     SUBSCRIBE = 3
     UNSUBSCRIBE = 4
+    RANGE = 5
     ERROR = -98
     INVALID = -99
 
@@ -18,20 +72,29 @@ class BadMBotRequestError(Exception):
 
 
 class MBotJSONMessage(object):
-    def __init__(self, data=None, channel=None, dtype=None, rtype=None, as_bytes=False, from_json=False):
+    # The serializer used to encode and decode all messages. Replace with set_serializer().
+    serializer = get_serializer()
+
+    @classmethod
+    def set_serializer(cls, name=None):
+        cls.serializer = get_serializer(name)
+
+    def __init__(self, data=None, channel=None, dtype=None, rtype=None, as_bytes=False, params=None,
+                 from_json=False):
         if from_json:
             self.decode(data)
         else:
             if rtype not in [MBotMessageType.INIT, MBotMessageType.REQUEST,
                              MBotMessageType.PUBLISH, MBotMessageType.RESPONSE,
                              MBotMessageType.SUBSCRIBE, MBotMessageType.UNSUBSCRIBE,
-                             MBotMessageType.ERROR, MBotMessageType.INVALID]:
+                             MBotMessageType.RANGE, MBotMessageType.ERROR, MBotMessageType.INVALID]:
                 raise AttributeError(f"Invalid message type: {rtype}")
             self._request_type = rtype
             self._data = data
             self._channel = channel
             self._dtype = dtype
             self._as_bytes = as_bytes
+            self._params = params
 
     def data(self):
         return self._data
@@ -48,6 +111,9 @@ class MBotJSONMessage(object):
     def as_bytes(self):
         return self._as_bytes
 
+    def params(self):
+        return self._params if self._params is not None else {}
+
     def encode(self):
         if self._request_type == MBotMessageType.INIT:
             rtype = "init"
@@ -61,6 +127,8 @@ class MBotJSONMessage(object):
             rtype = "subscribe"
         elif self._request_type == MBotMessageType.UNSUBSCRIBE:
             rtype = "unsubscribe"
+        elif self._request_type == MBotMessageType.RANGE:
+            rtype = "range"
         elif self._request_type == MBotMessageType.ERROR:
             rtype = "error"
         else:
@@ -72,28 +140,40 @@ class MBotJSONMessage(object):
             msg.update({"channel": self._channel})
         if self._dtype is not None:
             msg.update({"dtype": self._dtype})
-        if self._request_type in [MBotMessageType.REQUEST, MBotMessageType.SUBSCRIBE]:
+        if self._request_type in [MBotMessageType.REQUEST, MBotMessageType.SUBSCRIBE, MBotMessageType.RANGE] or \
+                self._as_bytes:
             msg.update({"as_bytes": self._as_bytes})
+        if self._params is not None:
+            msg.update({"params": self._params})
         if self._data is not None:
             # Special consideration for the lidar data because it's so big.
             if self._dtype == "lidar_t":
-                # Round to 4 data points.
-                self._data["ranges"] = np.round(self._data["ranges"], 4).tolist()
-                self._data["thetas"] = np.round(self._data["thetas"], 4).tolist()
-
-                # Remove times and intensities which are not used.
-                self._data.pop("intensities", None)
-                self._data.pop("times", None)
+                if isinstance(self._data, list):
+                    # A list of scans, for example from a range request.
+                    for scan in self._data:
+                        self._compact_lidar(scan)
+                else:
+                    self._compact_lidar(self._data)
 
             msg.update({"data": self._data})
 
-        return json.dumps(msg)
+        return self.serializer.dumps(msg)
+
+    def _compact_lidar(self, scan):
+        # Round to 4 data points.
+        # The arrays are passed to the serializer as they are, without converting them to lists.
+        scan["ranges"] = np.round(np.asarray(scan["ranges"], dtype=np.float64), 4)
+        scan["thetas"] = np.round(np.asarray(scan["thetas"], dtype=np.float64), 4)
+
+        # Remove times and intensities which are not used.
+        scan.pop("intensities", None)
+        scan.pop("times", None)
 
     def decode(self, data):
         raw_data = data
         # First try to load the data as JSON.
         try:
-            data = json.loads(data)
+            data = self.serializer.loads(data)
         except json.decoder.JSONDecodeError:
             raise BadMBotRequestError(f"Message is not valid JSON: \"{raw_data}\"")
 
@@ -116,9 +196,9 @@ class MBotJSONMessage(object):
         if "channel" in data:
             channel = data["channel"]
 
-        # The request should have a channel if it is a publish, subscribe or a request type.
-        if request_type in (MBotMessageType.REQUEST, MBotMessageType.PUBLISH,
-                            MBotMessageType.SUBSCRIBE, MBotMessageType.UNSUBSCRIBE) and channel is None:
+        # The request should have a channel if it is a publish, subscribe, range or a request type.
+        if request_type in (MBotMessageType.REQUEST, MBotMessageType.PUBLISH, MBotMessageType.SUBSCRIBE,
+                            MBotMessageType.UNSUBSCRIBE, MBotMessageType.RANGE) and channel is None:
             raise BadMBotRequestError("JSON request does not have a channel attribute.")
 
         # Read the data, if any.
@@ -131,8 +211,13 @@ class MBotJSONMessage(object):
         # Whether the data should be returned in raw bytes.
         as_bytes = data["as_bytes"] if "as_bytes" in data else False
 
-        # If this was a publish request, data is required.
-        if request_type == MBotMessageType.PUBLISH and (msg_data is None or dtype is None):
+        # Any extra parameters for the request.
+        params = data["params"] if "params" in data else None
+        if params is not None and not isinstance(params, dict):
+            raise BadMBotRequestError(f"Request parameters must be a JSON object. Got: \"{params}\"")
+
+        # If this was a publish request, data is required. Raw publishes carry the data after the JSON header.
+        if request_type == MBotMessageType.PUBLISH and ((msg_data is None and not as_bytes) or dtype is None):
             raise BadMBotRequestError("Publish was requested but data or data type is missing.")
 
         self._channel = channel
@@ -140,16 +225,17 @@ class MBotJSONMessage(object):
         self._dtype = dtype
         self._request_type = request_type
         self._as_bytes = as_bytes
+        self._params = params
 
 
 class MBotJSONRequest(MBotJSONMessage):
-    def __init__(self, channel, dtype=None, as_bytes=False):
-        super().__init__(channel=channel, dtype=dtype, as_bytes=as_bytes, rtype=MBotMessageType.REQUEST)
+    def __init__(self, channel, dtype=None, as_bytes=False, params=None):
+        super().__init__(channel=channel, dtype=dtype, as_bytes=as_bytes, params=params, rtype=MBotMessageType.REQUEST)
 
 
 class MBotJSONResponse(MBotJSONMessage):
-    def __init__(self, data, channel, dtype):
-        super().__init__(data, channel=channel, dtype=dtype, rtype=MBotMessageType.RESPONSE)
+    def __init__(self, data, channel, dtype, params=None):
+        super().__init__(data, channel=channel, dtype=dtype, rtype=MBotMessageType.RESPONSE, params=params)
 
 
 class MBotJSONPublish(MBotJSONMessage):
@@ -157,6 +243,49 @@ class MBotJSONPublish(MBotJSONMessage):
         super().__init__(data, channel=channel, dtype=dtype, rtype=MBotMessageType.PUBLISH)
 
 
+class MBotRawPublish(MBotJSONMessage):
+    """A request to publish a raw LCM message which was already encoded by the client.
+
+    This is sent as a binary websocket message: the length of the JSON header
+    as a 4 byte big endian integer, the JSON header, then the raw LCM message.
+    """
+
+    def __init__(self, data, channel=None, dtype=None, set_utime=False, from_json=False):
+        params = {"set_utime": True} if set_utime else None
+        super().__init__(data, channel=channel, dtype=dtype, rtype=MBotMessageType.PUBLISH, as_bytes=True,
+                         params=params, from_json=from_json)
+
+    def encode(self):
+        header = MBotJSONMessage(channel=self._channel, dtype=self._dtype, rtype=MBotMessageType.PUBLISH,
+                                 as_bytes=True, params=self._params).encode().encode("utf-8")
+        return struct.pack(">I", len(header)) + header + bytes(self._data)
+
+    def decode(self, data):
+        if len(data) < 4:
+            raise BadMBotRequestError("Raw publish is too short.")
+        size = struct.unpack_from(">I", data)[0]
+        if len(data) < 4 + size:
+            raise BadMBotRequestError(f"Raw publish header length ({size}) is longer than the message.")
+
+        try:
+            header = data[4:4 + size].decode("utf-8")
+        except UnicodeDecodeError:
+            raise BadMBotRequestError("Raw publish header is not valid UTF-8.")
+
+        super().decode(header)
+        if self._request_type != MBotMessageType.PUBLISH or not self._as_bytes:
+            raise BadMBotRequestError("Binary messages must be raw publish requests.")
+        self._data = data[4 + size:]
+
+
+class MBotJSONRange(MBotJSONMessage):
+    def __init__(self, channel, start_utime, end_utime, period=None, dtype=None, as_bytes=False):
+        params = {"start_utime": start_utime, "end_utime": end_utime}
+        if period is not None:
+            params.update({"period": period})
+        super().__init__(channel=channel, dtype=dtype, as_bytes=as_bytes, params=params, rtype=MBotMessageType.RANGE)
+
+
 class MBotJSONError(MBotJSONMessage):
     def __init__(self, msg):
         super().__init__(msg, rtype=MBotMessageType.ERROR)
@@ -0,0 +1,28 @@
+import importlib
+
+
+class LazyModule(object):
+    """A module which is only imported the first time one of its attributes
+    is used.
+
+    Heavy dependencies can be declared at the top of a file as usual, without
+    slowing down importing it. Scripts which never use the dependency never
+    pay for importing it.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        # Only called for attributes which aren't set on this object, so everything else goes to the module.
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
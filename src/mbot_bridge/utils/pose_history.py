@@ -0,0 +1,86 @@
+import threading
+import numpy as np
+
+
+class PoseHistory(object):
+    """Short ring buffer of 2D poses which can be queried for the pose at any time.
+
+    Poses between samples are linearly interpolated. Poses after the latest
+    sample are extrapolated using the velocity over the most recent samples, up
+    to a maximum time past the latest sample.
+    """
+
+    def __init__(self, size=100, velocity_window=5):
+        self.size = size
+        self.velocity_window = velocity_window
+
+        self._utimes = np.zeros(size, dtype=np.int64)
+        self._poses = np.zeros((size, 3), dtype=np.float64)
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def push(self, utime, x, y, theta):
+        self._lock.acquire()
+        self._utimes[self._next] = utime
+        self._poses[self._next] = (x, y, theta)
+        self._next = (self._next + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+        self._lock.release()
+
+    def _ordered(self):
+        self._lock.acquire()
+        if self._count < self.size:
+            utimes, poses = self._utimes[:self._count].copy(), self._poses[:self._count].copy()
+        else:
+            utimes = np.roll(self._utimes, -self._next)
+            poses = np.roll(self._poses, -self._next, axis=0)
+        self._lock.release()
+
+        # Samples normally arrive in order, but make sure the times are sorted before interpolating.
+        order = np.argsort(utimes, kind="stable")
+        return utimes[order], poses[order]
+
+    def pose_at(self, utime, max_extrapolation=0.2):
+        """Gets the pose at the given time.
+
+        Args:
+            utime (int): The time of the pose, in microseconds.
+            max_extrapolation (float, optional): The maximum time past the latest sample to extrapolate to, in
+                                                 seconds. Defaults to 0.2.
+
+        Returns:
+            tuple: The pose (x, y, theta), and whether it was extrapolated. The pose is None if the time is before the
+                   oldest sample or too far past the latest sample.
+        """
+        utimes, poses = self._ordered()
+        if len(utimes) == 0 or utime < utimes[0]:
+            return None, False
+
+        # Unwrap the angles so that interpolation doesn't jump across +/- pi.
+        thetas = np.unwrap(poses[:, 2])
+
+        if utime <= utimes[-1]:
+            x = np.interp(utime, utimes, poses[:, 0])
+            y = np.interp(utime, utimes, poses[:, 1])
+            theta = np.interp(utime, utimes, thetas)
+            return (float(x), float(y), float(self._wrap(theta))), False
+
+        dt = (utime - utimes[-1]) / 1e6
+        if dt > max_extrapolation:
+            return None, True
+
+        # Estimate the velocity from a least squares fit over the most recent samples.
+        window = slice(-min(self.velocity_window, len(utimes)), None)
+        t = (utimes[window] - utimes[-1]) / 1e6
+        if len(t) < 2 or t[0] == t[-1]:
+            vel = np.zeros(3)
+        else:
+            samples = np.column_stack((poses[window, 0], poses[window, 1], thetas[window]))
+            vel = np.polyfit(t, samples, 1)[0]
+
+        x, y, theta = poses[-1, 0] + vel[0] * dt, poses[-1, 1] + vel[1] * dt, thetas[-1] + vel[2] * dt
+        return (float(x), float(y), float(self._wrap(theta))), True
+
+    def _wrap(self, theta):
+        return (theta + np.pi) % (2 * np.pi) - np.pi
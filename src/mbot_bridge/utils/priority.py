@@ -0,0 +1,76 @@
+import asyncio
+
+# Priority classes, from most to least urgent.
+CONTROL = 0
+STATE = 1
+BULK = 2
+PRIORITY_CLASSES = {"control": CONTROL, "state": STATE, "bulk": BULK}
+
+
+def parse_priority(name):
+    """Gets the priority class from its name. Raises ValueError if the name is unknown."""
+    try:
+        return PRIORITY_CLASSES[str(name).lower()]
+    except KeyError:
+        raise ValueError(f"Unknown priority class: {name}. Must be one of: {list(PRIORITY_CLASSES.keys())}")
+
+
+class PriorityScheduler(object):
+    """Lets control and state messages be handled before bulk transfers.
+
+    Before a bulk message is sent, the sender waits until no control or state
+    responses are being sent. Large bulk messages are then sent in chunks,
+    giving other tasks a chance to run between them. The sender doesn't wait
+    for urgent messages in the middle of a message, since an urgent message on
+    the same connection can't be sent until the whole message has been.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, chunk_size=64 * 1024):
+        self.chunk_size = chunk_size
+        self._num_urgent = 0
+        self._idle = None
+
+    def enabled(self):
+        return self.chunk_size > 0
+
+    def begin(self, priority):
+        # Marks the start of handling a message with the given priority.
+        if priority == BULK:
+            return
+        if self._idle is None:
+            self._idle = asyncio.Event()
+        self._num_urgent += 1
+        self._idle.clear()
+
+    def end(self, priority):
+        if priority == BULK:
+            return
+        self._num_urgent -= 1
+        if self._num_urgent == 0:
+            self._idle.set()
+
+    async def wait_urgent(self):
+        """Waits until no control or state messages are being handled. Always gives other tasks a chance to run."""
+        await asyncio.sleep(0)
+        while self._num_urgent > 0:
+            await self._idle.wait()
+
+    async def _chunks(self, data):
+        for start in range(0, len(data), self.chunk_size):
+            if start > 0:
+                await asyncio.sleep(0)
+            yield data[start:start + self.chunk_size]
+
+    async def send(self, websocket, data, priority):
+        """Sends a message. Bulk messages wait for urgent messages to be sent first, and large ones are sent as
+        fragments."""
+        if priority != BULK or not self.enabled():
+            await websocket.send(data)
+            return
+
+        await self.wait_urgent()
+        if len(data) <= self.chunk_size:
+            await websocket.send(data)
+        else:
+            await websocket.send(self._chunks(data))
@@ -0,0 +1,102 @@
+import threading
+import numpy as np
+
+
+def reduce_scan(scan, bins=None, decimate=None):
+    """Reduces the resolution of a lidar scan.
+
+    Args:
+        scan: The decoded lidar_t message.
+        bins (int, optional): If provided, the scan is binned into this many equal angular bins over the full circle.
+                              Each bin has the closest valid range in the bin, or zero if there are no valid ranges,
+                              and the angle of the center of the bin. Defaults to None.
+        decimate (int, optional): If provided, only every decimate-th ray is kept. Defaults to None.
+
+    Returns:
+        dict: The reduced scan as a lidar_t dictionary, with the ranges and thetas as NumPy arrays.
+    """
+    ranges = np.asarray(scan.ranges, dtype=np.float32)
+    thetas = np.asarray(scan.thetas, dtype=np.float32)
+    times = np.asarray(scan.times, dtype=np.int64)
+    intensities = np.asarray(scan.intensities, dtype=np.float32)
+
+    if decimate is not None and decimate > 1:
+        ranges, thetas = ranges[::decimate], thetas[::decimate]
+        times, intensities = times[::decimate], intensities[::decimate]
+
+    if bins is not None and bins > 0:
+        idx = (np.mod(thetas, 2 * np.pi) / (2 * np.pi) * bins).astype(np.int64) % bins
+        valid = ranges > 0
+        binned = np.full(bins, np.inf, dtype=np.float32)
+        np.minimum.at(binned, idx[valid], ranges[valid])
+        binned[np.isinf(binned)] = 0
+
+        ranges = binned
+        thetas = ((np.arange(bins) + 0.5) * (2 * np.pi / bins)).astype(np.float32)
+        # Times and intensities don't have a meaning for a bin.
+        times = np.zeros(bins, dtype=np.int64)
+        intensities = np.zeros(bins, dtype=np.float32)
+
+    return {"utime": scan.utime, "num_ranges": len(ranges), "ranges": ranges, "thetas": thetas,
+            "times": times, "intensities": intensities}
+
+
+def _block_max(grid, factor):
+    # Pad to a multiple of the factor with the smallest value so padding never wins the max.
+    h, w = grid.shape
+    pad_h, pad_w = -h % factor, -w % factor
+    if pad_h or pad_w:
+        grid = np.pad(grid, ((0, pad_h), (0, pad_w)), constant_values=np.iinfo(grid.dtype).min)
+    h, w = grid.shape
+    return grid.reshape(h // factor, factor, w // factor, factor).max(axis=(1, 3))
+
+
+class MapPyramid(object):
+    """Downsampled copies of an occupancy grid at 2x, 4x, 8x, ... lower resolution.
+
+    Each cell of a downsampled grid has the maximum value of the cells it
+    covers, so obstacles are never lost. When the map is updated, only the
+    region which changed since the last update is recomputed.
+    """
+
+    def __init__(self, levels=3):
+        self.levels = levels
+        self._grid = None
+        self._pyramid = []
+        self._lock = threading.Lock()
+
+    def update(self, cells, width, height):
+        """Updates the pyramid with new map cells.
+
+        Args:
+            cells (numpy.ndarray): The int8 cells of the map, in row major order.
+            width (int): The width of the map, in cells.
+            height (int): The height of the map, in cells.
+        """
+        grid = np.asarray(cells, dtype=np.int8).reshape(height, width)
+
+        self._lock.acquire()
+        if self._grid is None or self._grid.shape != grid.shape:
+            # Compute the full pyramid.
+            self._pyramid = [_block_max(grid, 2**k) for k in range(1, self.levels + 1)]
+        else:
+            changed_rows, changed_cols = np.nonzero(grid != self._grid)
+            if len(changed_rows) > 0:
+                # Recompute the bounding box of the changes, aligned to the coarsest level's blocks.
+                block = 2**self.levels
+                r0, c0 = changed_rows.min() // block * block, changed_cols.min() // block * block
+                r1 = min(-(-(changed_rows.max() + 1) // block) * block, height)
+                c1 = min(-(-(changed_cols.max() + 1) // block) * block, width)
+                for k in range(1, self.levels + 1):
+                    f = 2**k
+                    region = _block_max(grid[r0:r1, c0:c1], f)
+                    self._pyramid[k - 1][r0 // f:r0 // f + region.shape[0], c0 // f:c0 // f + region.shape[1]] = region
+        self._grid = grid.copy()
+        self._lock.release()
+
+    def level(self, level):
+        """Gets the grid at the given level, where level k is 2^k times lower resolution. Level 0 is the full map."""
+        self._lock.acquire()
+        grid = self._grid if level == 0 else self._pyramid[level - 1].copy()
+        self._lock.release()
+        return grid
@@ -0,0 +1,109 @@
+import os
+import json
+import time
+import random
+import threading
+import collections
+
+
+class MessageTrace(object):
+    """Timings of the stages a single message goes through.
+
+    Each call to mark() ends a stage, which started at the previous mark (or at
+    the start of the trace). Optionally, the trace can start at an earlier
+    time, such as the time the message was published.
+    """
+
+    def __init__(self, tracer, trace_id, channel, kind, start_ns=None):
+        self._tracer = tracer
+        self.trace_id = trace_id
+        self.channel = channel
+        self.kind = kind
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.stages = []
+        self._last_ns = self.start_ns
+        self._finished = False
+
+    def set_start(self, start_ns):
+        # Move the start of the trace, before any stages have been marked.
+        self.start_ns = start_ns
+        self._last_ns = start_ns
+
+    def mark(self, stage):
+        now = time.time_ns()
+        self.stages.append((stage, self._last_ns, now - self._last_ns))
+        self._last_ns = now
+
+    def finish(self):
+        if not self._finished:
+            self._finished = True
+            self._tracer._record(self)
+
+
+class Tracer(object):
+    """Samples messages and records the time spent in each stage of handling them.
+
+    The traces can be exported either as a Chrome trace, which can be opened in
+    chrome://tracing or Perfetto, or as JSON lines with one trace per line.
+    """
+
+    def __init__(self, name, sample_rate=0.01, max_traces=10000):
+        self.name = name
+        self.sample_rate = sample_rate
+        self._traces = collections.deque(maxlen=max_traces)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def start(self, channel, kind, start_ns=None):
+        """Starts a trace for a message, if it is sampled. Returns None if the message is not traced."""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+
+        self._lock.acquire()
+        trace_id = self._next_id
+        self._next_id += 1
+        self._lock.release()
+        return MessageTrace(self, trace_id, channel, kind, start_ns)
+
+    def _record(self, trace):
+        self._lock.acquire()
+        self._traces.append(trace)
+        self._lock.release()
+
+    def traces(self):
+        self._lock.acquire()
+        traces = list(self._traces)
+        self._lock.release()
+        return traces
+
+    def chrome_events(self):
+        """The traces as Chrome trace events. Each trace is on its own row, grouped by channel."""
+        events = []
+        for trace in self.traces():
+            for stage, start_ns, dur_ns in trace.stages:
+                events.append({"name": stage, "cat": trace.kind, "ph": "X",
+                               "ts": start_ns / 1000, "dur": dur_ns / 1000,
+                               "pid": self.name, "tid": trace.channel,
+                               "args": {"trace_id": trace.trace_id}})
+        return events
+
+    def json_lines(self):
+        """The traces as a list of dictionaries, one per trace, with the duration of each stage in microseconds."""
+        lines = []
+        for trace in self.traces():
+            stages = {stage: dur_ns / 1000 for stage, _, dur_ns in trace.stages}
+            lines.append({"source": self.name, "trace_id": trace.trace_id, "channel": trace.channel,
+                          "kind": trace.kind, "start_utime": trace.start_ns // 1000,
+                          "stages": stages, "total": sum(stages.values())})
+        return lines
+
+    def export(self, path):
+        """Writes the traces to a file. If the path ends in .jsonl, the traces are written as JSON lines. Otherwise,
+        they are written as a Chrome trace."""
+        if os.path.splitext(path)[1] == ".jsonl":
+            with open(path, "w") as f:
+                for line in self.json_lines():
+                    f.write(json.dumps(line) + "\n")
+        else:
+            with open(path, "w") as f:
+                json.dump({"traceEvents": self.chrome_events(), "displayTimeUnit": "ms"}, f)
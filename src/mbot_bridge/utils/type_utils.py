@@ -1,6 +1,22 @@
+import os
+import json
+import logging
 import importlib
-import mbot_lcm_msgs
+import importlib.util
+import functools
+import threading
+import struct
 import base64
+from mbot_bridge.utils.lazy import LazyModule
+
+# Only imported once a message is decoded or a map is read, so that scripts start quickly.
+np = LazyModule("numpy")
+mbot_lcm_msgs = LazyModule("mbot_lcm_msgs")
+
+
+# The header of an occupancy_grid_t message, which comes before the cells in the raw data.
+OCCUPANCY_GRID_FIELDS = ["utime", "origin_x", "origin_y", "meters_per_cell", "width", "height", "num_cells"]
+OCCUPANCY_GRID_HEADER = struct.Struct(">qfffiii")
 
 
 class BadMessageError(Exception):
@@ -51,6 +67,131 @@ def find_lcm_type(data, pkgs):
     raise BadMessageError(f"Could not parse message type in packages: {[p for p in pkgs]}")
 
 
+class TypeRegistry(object):
+    """Finds the LCM type of raw messages from their fingerprints.
+
+    Every LCM message starts with the fingerprint of its type, so the type can
+    be looked up directly instead of trying to decode the message as each type
+    like find_lcm_type() does. Getting the fingerprints means importing every
+    type in the packages, so they can be saved to a cache file and loaded on
+    the next start. The saved fingerprints of a package are only used while
+    its files are unchanged.
+    """
+
+    CACHE_VERSION = 1
+
+    def __init__(self, pkgs, cache_file=None):
+        """
+        Args:
+            pkgs (list): The names of the message packages to search in. Types in earlier packages are found first.
+            cache_file (str, optional): The file to save the fingerprints to. Defaults to None, which scans the
+                                        packages every time.
+        """
+        self.pkgs = list(pkgs)
+        self.cache_file = cache_file
+        self._types = None  # The type name for each fingerprint, as a hex string.
+        self._rescanned = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _signature(pkg_name):
+        # Identifies the version of the package's files without importing it. Adding or regenerating types changes
+        # the package directory or its __init__.py.
+        spec = importlib.util.find_spec(pkg_name)
+        if spec is None:
+            raise ModuleNotFoundError(f"No module named '{pkg_name}'")
+        signature = []
+        for path in [spec.origin] + list(spec.submodule_search_locations or []):
+            if path is not None and os.path.exists(path):
+                stat = os.stat(path)
+                signature.append([path, stat.st_mtime_ns, stat.st_size])
+        return signature
+
+    @staticmethod
+    def _scan(pkg_name):
+        pkg_module = importlib.import_module(pkg_name)
+        types = {}
+        for attr in dir(pkg_module):
+            lcm_type_class = getattr(pkg_module, attr)
+            if isinstance(lcm_type_class, type) and hasattr(lcm_type_class, "_get_packed_fingerprint"):
+                lcm_type = lcm_type_class.__name__
+                if pkg_name != "mbot_lcm_msgs":
+                    # Add the package prefix if this isn't in mbot_lcm_msgs.
+                    lcm_type = pkg_name + "." + lcm_type
+                types.setdefault(lcm_type_class._get_packed_fingerprint().hex(), lcm_type)
+        return types
+
+    def _read_cache(self):
+        if self.cache_file is None:
+            return {}
+        try:
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cache, dict) or cache.get("version") != self.CACHE_VERSION:
+            return {}
+        return cache.get("packages", {})
+
+    def _write_cache(self, packages):
+        tmp_file = self.cache_file + ".tmp"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            with open(tmp_file, "w") as f:
+                json.dump({"version": self.CACHE_VERSION, "packages": packages}, f)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logging.warning(f"Could not save the LCM type cache to {self.cache_file}: {e}")
+
+    def load(self, rescan=False):
+        """Gets the fingerprints of the types in the packages, from the cache file if it is up to date. If rescan
+        is True, the packages are always scanned again."""
+        packages = self._read_cache()
+        changed = False
+        types = {}
+        for pkg_name in self.pkgs:
+            try:
+                signature = self._signature(pkg_name)
+            except (ImportError, ValueError) as e:
+                logging.warning(f"Can't load LCM types from package {pkg_name}: {e}")
+                continue
+
+            entry = packages.get(pkg_name)
+            if rescan or entry is None or entry.get("signature") != signature:
+                try:
+                    entry = {"signature": signature, "types": self._scan(pkg_name)}
+                except ImportError as e:
+                    # The package exists but can't be imported, for example if it depends on a missing module.
+                    logging.warning(f"Can't load LCM types from package {pkg_name}: {e}")
+                    packages.pop(pkg_name, None)
+                    continue
+                packages[pkg_name] = entry
+                changed = True
+
+            for fingerprint, lcm_type in entry["types"].items():
+                types.setdefault(fingerprint, lcm_type)
+
+        if changed and self.cache_file is not None:
+            self._write_cache(packages)
+        self._types = types
+
+    def find(self, data):
+        """Gets the name of the LCM type of raw message data. Raises BadMessageError if no type matches."""
+        with self._lock:
+            if self._types is None:
+                self.load()
+            fingerprint = bytes(data[:8]).hex()
+            if fingerprint not in self._types and not self._rescanned:
+                # The cache might be out of date even though the files look the same, so check once more.
+                self._rescanned = True
+                self.load(rescan=True)
+
+        try:
+            return self._types[fingerprint]
+        except KeyError:
+            raise BadMessageError(f"Could not parse message type in packages: {self.pkgs}")
+
+
 def decode(data, dtype):
     """Decode raw data from LCM channel to type based on type string."""
     try:
@@ -60,21 +201,87 @@ def decode(data, dtype):
     return lcm_obj.decode(data)
 
 
+@functools.lru_cache(maxsize=None)
+def has_leading_utime(dtype):
+    """Whether the first field of the given type is an int64_t utime, in which
+    case it can be read directly from the raw data."""
+    try:
+        lcm_obj = str_to_lcm_type(dtype)
+    except (ValueError, AttributeError, ModuleNotFoundError):
+        return False
+    slots, typenames = getattr(lcm_obj, "__slots__", []), getattr(lcm_obj, "__typenames__", [])
+    return len(slots) > 0 and slots[0] == "utime" and typenames[0] == "int64_t"
+
+
+def read_utime(data, dtype):
+    """Reads the utime of a raw LCM message without decoding the whole message.
+    Returns None if the type has no utime."""
+    if has_leading_utime(dtype):
+        # The encoded message starts with the 8 byte type fingerprint, followed by the fields in big endian order.
+        return struct.unpack_from(">q", data, 8)[0]
+
+    msg = decode(data, dtype)
+    return getattr(msg, "utime", None)
+
+
+def check_fingerprint(data, dtype):
+    """Checks that raw LCM data starts with the fingerprint of the given type,
+    without decoding it. Raises BadMessageError if it doesn't."""
+    try:
+        lcm_obj = str_to_lcm_type(dtype)
+    except (ValueError, AttributeError, ModuleNotFoundError) as e:
+        raise BadMessageError(f"Could not parse dtype {dtype}: {e}")
+    if data[:8] != lcm_obj._get_packed_fingerprint():
+        raise BadMessageError(f"Data does not have the fingerprint of type {dtype}.")
+
+
+def write_utime(data, dtype, utime):
+    """Replaces the utime of a raw LCM message without decoding the rest of
+    the message. Returns the new raw data."""
+    if not has_leading_utime(dtype) or len(data) < 16:
+        raise BadMessageError(f"Type {dtype} does not start with a utime.")
+    return b"".join((data[:8], struct.pack(">q", utime), data[16:]))
+
+
+def occupancy_grid_to_array(data):
+    """Reads a raw occupancy grid without decoding the cells into Python
+    objects. Returns a dictionary of the header fields and the cells as a NumPy
+    int8 array, which is a view over the raw data."""
+    grid_type = mbot_lcm_msgs.occupancy_grid_t
+    if list(grid_type.__slots__) != OCCUPANCY_GRID_FIELDS + ["cells"]:
+        # The type doesn't have the expected layout, so do a full decode.
+        decoded_data = grid_type.decode(data)
+        header = {k: getattr(decoded_data, k) for k in OCCUPANCY_GRID_FIELDS}
+        return header, np.array(decoded_data.cells, dtype=np.int8)
+
+    if data[:8] != grid_type._get_packed_fingerprint():
+        raise BadMessageError("Data is not an occupancy grid.")
+
+    header = dict(zip(OCCUPANCY_GRID_FIELDS, OCCUPANCY_GRID_HEADER.unpack_from(data, 8)))
+    cells = np.frombuffer(data, dtype=np.int8, count=header["num_cells"], offset=8 + OCCUPANCY_GRID_HEADER.size)
+    return header, cells
+
+
+def array_to_occupancy_grid(header, cells):
+    """Encodes an occupancy grid from a dictionary of the header fields and a
+    NumPy int8 array of the cells. The inverse of occupancy_grid_to_array()."""
+    grid_type = mbot_lcm_msgs.occupancy_grid_t
+    cells = np.ascontiguousarray(cells, dtype=np.int8)
+    if list(grid_type.__slots__) != OCCUPANCY_GRID_FIELDS + ["cells"]:
+        msg = dict_to_lcm_type(header, "occupancy_grid_t")
+        msg.num_cells = cells.size
+        msg.cells = cells.ravel().tolist()
+        return msg.encode()
+
+    values = [header[k] for k in OCCUPANCY_GRID_FIELDS[:-1]] + [cells.size]
+    return grid_type._get_packed_fingerprint() + OCCUPANCY_GRID_HEADER.pack(*values) + cells.tobytes()
+
+
 def occupancy_grid_to_byte_dict(data):
     """A special case utility for decoding the occupancy grid, but keeping the
     cell data as bytes."""
-    decoded_data = mbot_lcm_msgs.occupancy_grid_t.decode(data)  # Decode the data.
-    cell_bytes = data[-decoded_data.num_cells:]  # Extract the cells as bytes.
-    data_d = {
-        "utime": decoded_data.utime,
-        "origin_x": decoded_data.origin_x ,
-        "origin_y": decoded_data.origin_y,
-        "meters_per_cell": decoded_data.meters_per_cell,
-        "width": decoded_data.width,
-        "height": decoded_data.height,
-        "num_cells": decoded_data.num_cells,
-        "cells": base64.b64encode(cell_bytes).decode('utf-8'),  # The cells should remain as bytes.
-    }
+    data_d, cells = occupancy_grid_to_array(data)
+    data_d.update({"cells": base64.b64encode(cells).decode('utf-8')})  # The cells should remain as bytes.
     return data_d
 
 
@@ -0,0 +1,44 @@
+import time
+import base64
+import numpy as np
+from mbot_bridge.utils.json_messages import MBotJSONMessage, MBotJSONResponse, get_serializer, orjson
+
+# Benchmark encoding and decoding of JSON responses for each message type, with each available serializer.
+N = 2000
+
+rng = np.random.default_rng(0)
+MSGS = {
+    "pose2D_t": lambda: {"utime": 1700000000000000, "x": 1.2345, "y": -0.5, "theta": 0.25},
+    "twist2D_t": lambda: {"utime": 1700000000000000, "vx": 0.5, "vy": 0.0, "wz": 0.1},
+    "path2D_t": lambda: {"utime": 1700000000000000, "path_length": 100,
+                         "path": [{"utime": 0, "x": float(i), "y": float(i), "theta": 0.0} for i in range(100)]},
+    "lidar_t": lambda: {"utime": 1700000000000000, "num_ranges": 720,
+                        "ranges": tuple(rng.uniform(0, 10, 720).astype(np.float32).tolist()),
+                        "thetas": tuple(np.linspace(0, 2 * np.pi, 720, dtype=np.float32).tolist()),
+                        "times": tuple([0] * 720), "intensities": tuple([0.0] * 720)},
+    "occupancy_grid_t": lambda: {"utime": 1700000000000000, "origin_x": -5.0, "origin_y": -5.0,
+                                 "meters_per_cell": 0.05, "width": 200, "height": 200, "num_cells": 40000,
+                                 "cells": base64.b64encode(rng.integers(-128, 127, 40000, dtype=np.int8)).decode()},
+}
+
+serializers = ["json"] + (["orjson"] if orjson is not None else [])
+print(f"{'type':<18}{'serializer':<12}{'encode (us)':>14}{'decode (us)':>14}{'size (B)':>10}")
+for dtype, make in MSGS.items():
+    for name in serializers:
+        MBotJSONMessage.set_serializer(name)
+        # Messages are created inside the timed loop since encoding modifies lidar data in place.
+        data = [make() for _ in range(N)]
+        start = time.perf_counter()
+        for d in data:
+            encoded = MBotJSONResponse(d, "CH", dtype).encode()
+        t_enc = (time.perf_counter() - start) / N * 1e6
+
+        start = time.perf_counter()
+        for _ in range(N):
+            MBotJSONMessage(encoded, from_json=True)
+        t_dec = (time.perf_counter() - start) / N * 1e6
+
+        print(f"{dtype:<18}{name:<12}{t_enc:>14.1f}{t_dec:>14.1f}{len(encoded):>10}")
+
+MBotJSONMessage.set_serializer()
+print("Default serializer:", get_serializer().name)
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import websockets
+from mbot_bridge.utils import type_utils
+from mbot_bridge.utils.json_messages import MBotJSONRequest, MBotJSONPublish, MBotRawPublish
+
+# Benchmark the latency of motor commands while other clients are downloading large maps. Each command is a publish
+# followed by a hostname request on the same connection, so the response arrives once the server has handled the
+# command. The server is run with and without priority scheduling.
+
+
+def start_server(port, chunk_kb, log_dir):
+    cmd = [sys.executable, "-m", "mbot_bridge.server", "--lcm-address", "memq://", "--port", str(port),
+           "--log-file", os.path.join(log_dir, f"server_{port}.log"), "--log", "WARNING",
+           "--bulk-chunk-kb", str(chunk_kb)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    async def wait_ready():
+        for _ in range(100):
+            try:
+                async with websockets.connect(f"ws://localhost:{port}"):
+                    return
+            except OSError:
+                await asyncio.sleep(0.1)
+        raise RuntimeError("Server did not start.")
+
+    asyncio.run(wait_ready())
+    return proc
+
+
+def make_map(size, utime):
+    header = {"utime": utime, "origin_x": 0.0, "origin_y": 0.0, "meters_per_cell": 0.05,
+              "width": size, "height": size, "num_cells": size * size}
+    cells = np.random.default_rng(utime).integers(-100, 100, size * size, dtype=np.int8)
+    return type_utils.array_to_occupancy_grid(header, cells)
+
+
+def map_loader(port, map_size, publish, stop):
+    # Reads the map over and over. One loader also publishes new maps so the server has to encode them again.
+    async def run():
+        uri = f"ws://localhost:{port}"
+        async with websockets.connect(uri, max_size=None) as ws:
+            utime = 0
+            while not stop.is_set():
+                if publish:
+                    utime += 1
+                    await ws.send(MBotRawPublish(make_map(map_size, utime), "SLAM_MAP", "occupancy_grid_t").encode())
+                await ws.send(MBotJSONRequest("SLAM_MAP").encode())
+                await ws.recv()
+
+    asyncio.run(run())
+
+
+async def command_latencies(port, num_commands, rate):
+    cmd = MBotJSONPublish({"vx": 0.0, "vy": 0.0, "wz": 0.0}, "MBOT_VEL_CMD", "twist2D_t").encode()
+    ping = MBotJSONRequest("HOSTNAME").encode()
+    latencies = []
+    async with websockets.connect(f"ws://localhost:{port}") as ws:
+        for _ in range(num_commands):
+            start = time.perf_counter()
+            await ws.send(cmd)
+            await ws.send(ping)
+            await ws.recv()
+            latencies.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(1 / rate)
+    return np.array(latencies)
+
+
+def run_case(port, chunk_kb, args, log_dir):
+    server = start_server(port, chunk_kb, log_dir)
+    stop = multiprocessing.Event()
+    loaders = []
+    try:
+        if args.loaders > 0:
+            # Publish the first map before loading starts, so there is always a map to read.
+            async def first_map():
+                async with websockets.connect(f"ws://localhost:{port}") as ws:
+                    await ws.send(MBotRawPublish(make_map(args.map_size, 0), "SLAM_MAP", "occupancy_grid_t").encode())
+            asyncio.run(first_map())
+            time.sleep(0.5)
+
+            loaders = [multiprocessing.Process(target=map_loader, args=(port, args.map_size, i == 0, stop))
+                       for i in range(args.loaders)]
+            for p in loaders:
+                p.start()
+            time.sleep(1)
+
+        return asyncio.run(command_latencies(port, args.commands, args.rate))
+    finally:
+        stop.set()
+        for p in loaders:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Command latency under concurrent map load.")
+    parser.add_argument("--map-size", type=int, default=1000, help="Width and height of the map, in cells.")
+    parser.add_argument("--loaders", type=int, default=4, help="Number of clients reading the map.")
+    parser.add_argument("--commands", type=int, default=200, help="Number of commands to send.")
+    parser.add_argument("--rate", type=float, default=50, help="Rate to send commands at, in Hz.")
+    parser.add_argument("--port", type=int, default=5105, help="Port to run the servers on.")
+    args = parser.parse_args()
+
+    cases = [("idle", 64, 0), ("map load, no priority", 0, args.loaders), ("map load, priority", 64, args.loaders)]
+    print(f"Map: {args.map_size}x{args.map_size}, {args.loaders} map clients, {args.commands} commands")
+    print(f"{'case':<24}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}")
+    with tempfile.TemporaryDirectory() as log_dir:
+        for i, (name, chunk_kb, loaders) in enumerate(cases):
+            args.loaders = loaders
+            lat = run_case(args.port + i, chunk_kb, args, log_dir)
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            print(f"{name:<24}{p50:>10.2f}{p95:>10.2f}{p99:>10.2f}{lat.max():>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
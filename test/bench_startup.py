@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import websockets
+from mbot_bridge.utils.json_messages import MBotJSONRequest, MBotRawPublish, MBotJSONMessage, MBotMessageType
+
+# Benchmark how long it takes to import the API and to start the server. The import is compared to importing the
+# dependencies it used to import eagerly. The server is timed until it accepts connections, and until it has found the
+# type of a new channel, with and without an up to date type cache.
+
+IMPORT_CASES = [
+    ("import mbot_bridge.api", "import mbot_bridge.api"),
+    ("+ eager dependencies", "import mbot_bridge.api, asyncio, websockets, numpy, mbot_lcm_msgs"),
+]
+
+
+def time_command(code, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return np.array(times)
+
+
+async def wait_ready(port, proc):
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError("Server exited.")
+        try:
+            async with websockets.connect(f"ws://localhost:{port}"):
+                return
+        except OSError:
+            await asyncio.sleep(0.005)
+
+
+async def wait_typed(port):
+    # Publish a message on a new channel without a type, and wait until the server has found its type.
+    from mbot_lcm_msgs import pose2D_t
+    async with websockets.connect(f"ws://localhost:{port}") as ws:
+        await ws.send(MBotRawPublish(pose2D_t().encode(), "BENCH_POSE", "pose2D_t").encode())
+        while True:
+            await ws.send(MBotJSONRequest("BENCH_POSE", dtype="pose2D_t").encode())
+            res = MBotJSONMessage(await ws.recv(), from_json=True)
+            if res.type() == MBotMessageType.RESPONSE:
+                return
+            await asyncio.sleep(0.005)
+
+
+def time_server(port, type_cache, log_dir):
+    cmd = [sys.executable, "-m", "mbot_bridge.server", "--lcm-address", "memq://", "--port", str(port),
+           "--log-file", os.path.join(log_dir, f"server_{port}.log"), "--log", "WARNING", "--type-cache", type_cache]
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_ready(port, proc))
+        ready = time.perf_counter() - start
+        asyncio.run(wait_typed(port))
+        typed = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+    return ready * 1000, typed * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time of the API and the server.")
+    parser.add_argument("--runs", type=int, default=10, help="Number of times to run each case.")
+    parser.add_argument("--port", type=int, default=5205, help="Port to run the servers on.")
+    args = parser.parse_args()
+
+    print(f"{'import':<30}{'median (ms)':>12}{'min (ms)':>12}")
+    for name, code in IMPORT_CASES:
+        times = time_command(code, args.runs)
+        print(f"{name:<30}{np.median(times):>12.1f}{times.min():>12.1f}")
+
+    print()
+    print(f"{'server':<30}{'ready (ms)':>12}{'typed (ms)':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = os.path.join(tmp_dir, "lcm_types.json")
+        # Each case is the cache file to use, and whether to delete it before each run.
+        cases = [("no type cache", "", False), ("cold type cache", cache, True), ("warm type cache", cache, False)]
+        for i, (name, type_cache, clear) in enumerate(cases):
+            results = []
+            for j in range(args.runs):
+                if clear and os.path.exists(cache):
+                    os.remove(cache)
+                results.append(time_server(args.port + i * args.runs + j, type_cache, tmp_dir))
+            ready, typed = np.median(np.array(results), axis=0)
+            print(f"{name:<30}{ready:>12.1f}{typed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
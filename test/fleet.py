@@ -0,0 +1,24 @@
+import sys
+from mbot_bridge.api import MBotFleet
+
+# Reads from and subscribes to several MBot Bridge servers at once. To test locally, start several servers on
+# different ports, each with its own host file so they have different names:
+#   echo robot-a > /tmp/robot-a && python -m mbot_bridge.server --port 5005 --host-file /tmp/robot-a
+#   echo robot-b > /tmp/robot-b && python -m mbot_bridge.server --port 5006 --host-file /tmp/robot-b
+# Then run:
+#   python fleet.py localhost:5005 localhost:5006
+bridges = sys.argv[1:] if len(sys.argv) > 1 else ["localhost:5005"]
+fleet = MBotFleet(bridges)
+print("Fleet:", fleet.hostnames())
+
+# Read the latest odometry from all the robots at once.
+for hostname, odom in fleet.read_odometry().items():
+    print(hostname, "odometry:", odom)
+
+# Print the odometry from all the robots as it arrives, until no data arrives for a second.
+fleet.subscribe(fleet.lcm_config.ODOMETRY.channel)
+for hostname, channel, msg in fleet.listen(timeout=1):
+    print(hostname, channel, msg.x, msg.y, msg.theta)
+
+fleet.stop()
+fleet.close()